@@ -4,3 +4,12 @@ from django.apps import AppConfig
 class ApiConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'api'
+
+    def ready(self):
+        from django.db.models import CharField
+
+        from . import signals  # noqa: F401
+        from .lookups import TrigramIContains, TrigramWordSimilar
+
+        CharField.register_lookup(TrigramWordSimilar)
+        CharField.register_lookup(TrigramIContains)
@@ -0,0 +1,61 @@
+import hashlib
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import router
+from rest_framework.authentication import TokenAuthentication
+from users.models import User
+
+SNAPSHOT_FIELDS = ('id', 'email', 'username', 'first_name', 'last_name',
+                   'is_active', 'is_staff', 'is_superuser')
+
+
+def token_cache_key(key):
+    """Ключ кэша по хэшу токена, чтобы сам токен не хранился в кэше."""
+
+    return 'auth_token:' + hashlib.sha256(key.encode()).hexdigest()
+
+
+def forget_tokens(*keys):
+    caches[settings.AUTH_TOKEN_CACHE_ALIAS].delete_many(
+        [token_cache_key(key) for key in keys])
+
+
+def user_from_snapshot(snapshot):
+    """Пользователь из сохранённых полей; остальные поля отложены и
+    подгрузятся из базы при обращении, а save() запишет только
+    загруженные поля."""
+
+    fields = [field.attname for field in User._meta.concrete_fields
+              if field.attname in snapshot]
+    return User.from_db(
+        router.db_for_read(User), fields,
+        [snapshot[field] for field in fields])
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """TokenAuthentication, который держит в кэше снимок пользователя
+    по токену AUTH_TOKEN_CACHE_TIMEOUT секунд. Неактивные пользователи
+    не кэшируются: их отсекает проверка в TokenAuthentication.
+
+    Запись удаляется при удалении токена (logout) и при любом сохранении
+    пользователя, в том числе смене пароля и деактивации.
+    """
+
+    def authenticate_credentials(self, key):
+        cache = caches[settings.AUTH_TOKEN_CACHE_ALIAS]
+        cache_key = token_cache_key(key)
+        snapshot = cache.get(cache_key)
+        if snapshot is None:
+            user, token = super().authenticate_credentials(key)
+            cache.set(
+                cache_key,
+                {field: getattr(user, field) for field in SNAPSHOT_FIELDS},
+                settings.AUTH_TOKEN_CACHE_TIMEOUT
+            )
+            return user, token
+        user = user_from_snapshot(snapshot)
+        token = self.get_model().from_db(
+            user._state.db, ('key', 'user_id'), (key, user.pk))
+        token.user = user
+        return user, token
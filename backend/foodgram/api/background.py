@@ -0,0 +1,22 @@
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def submit(executor, func, *args):
+    """Ставит func(*args) в пул потоков executor.
+
+    Результат задачи никто не ждёт, поэтому её исключение иначе
+    пропало бы вместе с future: оно пишется в лог.
+    """
+
+    def task():
+        try:
+            return func(*args)
+        except Exception:
+            logger.exception(
+                'Фоновая задача %s%r завершилась ошибкой',
+                func.__qualname__, args)
+            raise
+
+    return executor.submit(task)
@@ -0,0 +1,29 @@
+import csv
+
+
+class CopyStream:
+    """Файлоподобный источник для COPY: строки CSV из генератора."""
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.pending = []
+        self.size = 0
+        self.writer = csv.writer(self)
+
+    def write(self, line):
+        self.pending.append(line)
+        self.size += len(line)
+
+    def read(self, size=-1):
+        while size < 0 or self.size < size:
+            row = next(self.rows, None)
+            if row is None:
+                break
+            self.writer.writerow(row)
+        data = ''.join(self.pending)
+        if 0 <= size < len(data):
+            data, rest = data[:size], data[size:]
+            self.pending, self.size = [rest], len(rest)
+        else:
+            self.pending, self.size = [], 0
+        return data
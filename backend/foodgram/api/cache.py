@@ -0,0 +1,82 @@
+from hashlib import md5
+
+from django.conf import settings
+from django.core.cache import caches
+from recipes.models import ModelVersion
+
+STATS_KEYS = ('hits', 'misses')
+
+
+def get_model_versions(request, keys):
+    """Счётчики ModelVersion, запрошенные не более одного раза за запрос.
+
+    Используются и валидаторами условных запросов, и ключами кэша,
+    поэтому данные не устаревают ни в одном бэкенде кэша, включая locmem
+    в нескольких воркерах.
+    """
+
+    if request is None:
+        return ModelVersion.objects.get_versions(keys)
+    memo = getattr(request, '_model_versions', None)
+    if memo is None:
+        memo = {}
+        setattr(request, '_model_versions', memo)
+    missing = [key for key in keys if key not in memo]
+    if missing:
+        found = ModelVersion.objects.get_versions(missing)
+        memo.update({key: found.get(key) for key in missing})
+    return {key: memo[key] for key in keys if memo[key] is not None}
+
+
+class VersionedCache:
+    """Кэш, в ключ которого входят версии моделей вместо TTL."""
+
+    prefix = 'versioned'
+
+    def __init__(self, alias, timeout):
+        self.alias = alias
+        self.timeout = timeout
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    def make_key(self, namespace, parts, versions):
+        digest = md5(
+            repr((parts, sorted(versions.items()))).encode()).hexdigest()
+        return f'{self.prefix}:{namespace}:{digest}'
+
+    def count(self, name):
+        key = f'{self.prefix}:stats:{name}'
+        self.cache.add(key, 0, timeout=None)
+        try:
+            self.cache.incr(key)
+        except ValueError:
+            self.cache.set(key, 1, timeout=None)
+
+    def get(self, key):
+        value = self.cache.get(key)
+        self.count('misses' if value is None else 'hits')
+        return value
+
+    def set(self, key, value):
+        self.cache.set(key, value, timeout=self.timeout)
+
+    def get_or_set(self, key, producer):
+        value = self.get(key)
+        if value is None:
+            value = producer()
+            self.set(key, value)
+        return value
+
+    def stats(self):
+        values = self.cache.get_many(
+            [f'{self.prefix}:stats:{name}' for name in STATS_KEYS])
+        return {
+            name: values.get(f'{self.prefix}:stats:{name}', 0)
+            for name in STATS_KEYS
+        }
+
+
+response_cache = VersionedCache(
+    settings.RESPONSE_CACHE_ALIAS, settings.RESPONSE_CACHE_TIMEOUT)
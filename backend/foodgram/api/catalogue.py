@@ -0,0 +1,104 @@
+import gzip
+from hashlib import sha256
+
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from recipes.models import Ingredient, ModelVersion
+from rest_framework.renderers import JSONRenderer
+
+from .cache import get_model_versions, response_cache
+from .serializers import IngredientSerializer
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+IDENTITY = 'identity'
+
+
+def accepted_encodings(header):
+    """Кодировки из Accept-Encoding с q > 0, по убыванию q."""
+
+    weighted = []
+    for position, item in enumerate(header.split(',')):
+        coding, *params = [part.strip() for part in item.split(';')]
+        quality = 1.0
+        for param in params:
+            name, _, value = param.partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if coding and quality > 0:
+            weighted.append((-quality, position, coding.lower()))
+    return [coding for _, _, coding in sorted(weighted)]
+
+
+class IngredientCatalogue:
+    """Полный справочник ингредиентов, заранее сжатый gzip и brotli.
+
+    JSON и сжатые варианты собираются один раз на версию ингредиентов,
+    хранятся в общем кэше и в памяти воркера, а в ответ отдаются без
+    сериализации и сжатия. Вариант выбирается по Accept-Encoding,
+    у каждого свой строгий ETag.
+    """
+
+    def __init__(self):
+        self._version = None
+        self._blobs = None
+
+    def build(self):
+        content = JSONRenderer().render(IngredientSerializer(
+            Ingredient.objects.all(), many=True).data)
+        blobs = {
+            IDENTITY: content,
+            'gzip': gzip.compress(content, compresslevel=9, mtime=0),
+        }
+        if brotli is not None:
+            blobs['br'] = brotli.compress(
+                content, mode=brotli.MODE_TEXT, quality=11)
+        digest = sha256(content).hexdigest()
+        return {
+            coding: (blob, f'"{digest}"' if coding == IDENTITY
+                     else f'"{digest}-{coding}"')
+            for coding, blob in blobs.items()
+        }
+
+    def get_blobs(self, request):
+        versions = get_model_versions(
+            request, (ModelVersion.objects.key_for(Ingredient),))
+        if versions != self._version or self._blobs is None:
+            self._blobs = response_cache.get_or_set(
+                response_cache.make_key('ingredient_catalogue', (), versions),
+                self.build
+            )
+            self._version = versions
+        return self._blobs
+
+    def select(self, blobs, header):
+        for coding in accepted_encodings(header):
+            if coding == '*':
+                coding = 'br' if 'br' in blobs else 'gzip'
+            if coding in blobs:
+                return coding
+        return IDENTITY
+
+    def response(self, request):
+        blobs = self.get_blobs(request)
+        coding = self.select(
+            blobs, request.META.get('HTTP_ACCEPT_ENCODING', ''))
+        content, etag = blobs[coding]
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            response = HttpResponse(
+                content, content_type='application/json')
+            if coding != IDENTITY:
+                response['Content-Encoding'] = coding
+        response['ETag'] = etag
+        patch_vary_headers(response, ('Accept-Encoding',))
+        return response
+
+
+ingredient_catalogue = IngredientCatalogue()
@@ -0,0 +1,35 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from recipes.models import FeedEntry, Recipe
+
+from .background import submit
+from .postgresql.base import releasing_connections
+
+feed_executor = ThreadPoolExecutor(
+    max_workers=settings.FEED_WORKERS,
+    thread_name_prefix='recipe_feed'
+)
+
+
+@releasing_connections
+def fan_out_rest(recipe_id, after):
+    """Дополняет ленты оставшихся подписчиков в фоне."""
+
+    recipe = Recipe.objects.filter(pk=recipe_id).only(
+        'id', 'author_id', 'created').first()
+    if recipe is not None:
+        FeedEntry.objects.fan_out(recipe, after=after)
+
+
+def schedule_fan_out(recipe):
+    """Раскладывает новый рецепт по лентам подписчиков.
+
+    Первые FEED_SYNC_FANOUT_LIMIT подписчиков обрабатываются сразу,
+    остальные - в фоновом потоке, чтобы публикация у автора с большим
+    числом подписчиков не задерживала ответ.
+    """
+    after = FeedEntry.objects.fan_out(
+        recipe, limit=settings.FEED_SYNC_FANOUT_LIMIT)
+    if after is not None:
+        submit(feed_executor, fan_out_rest, recipe.pk, after)
@@ -1,12 +1,52 @@
 import django_filters
+from django.conf import settings
+from django.contrib.postgres.search import SearchQuery, SearchRank
+from django.db.models import (Case, Exists, F, IntegerField, OuterRef, Q,
+                              Value, When)
 from django_filters import rest_framework
 from django_filters.rest_framework import FilterSet
-from recipes.models import Favorite, Ingredient, Recipe, ShoppingCart, Tag
+from recipes.models import (Favorite, Ingredient, ModelVersion, Recipe,
+                            ShoppingCart, Tag)
+
+from .cache import get_model_versions, response_cache
+from .lookups import TrigramWordSimilarity
+
+
+def tag_choices(request):
+    """Слаги тегов для проверки фильтра, из кэша по версии тегов."""
+
+    versions = get_model_versions(
+        request, (ModelVersion.objects.key_for(Tag),))
+    return response_cache.get_or_set(
+        response_cache.make_key('tag_choices', (), versions),
+        lambda: list(Tag.objects.values_list('slug', 'name'))
+    )
 
 
 class IngredientFilter(FilterSet):
 
     name = rest_framework.CharFilter(lookup_expr='startswith')
+    search = rest_framework.CharFilter(method='search_filter')
+
+    def search_filter(self, queryset, name, value):
+        """Нечёткий поиск по триграммам: сначала совпадения с начала
+        названия, затем с начала слова, затем по убыванию сходства."""
+
+        value = value.strip().lower()
+        return queryset.filter(
+            Q(name__trigram_icontains=value)
+            | Q(name__trigram_word_similar=value)
+        ).annotate(
+            rank=Case(
+                When(name__istartswith=value, then=Value(0)),
+                When(name__icontains=f' {value}', then=Value(1)),
+                default=Value(2),
+                output_field=IntegerField()
+            ),
+            similarity=TrigramWordSimilarity(value, 'name')
+        ).order_by(
+            'rank', '-similarity', 'name'
+        )[:settings.INGREDIENT_SEARCH_LIMIT]
 
     class Meta:
         model = Ingredient
@@ -15,10 +55,8 @@ class IngredientFilter(FilterSet):
 
 class RecipeFilter(django_filters.FilterSet):
 
-    tags = django_filters.filters.ModelMultipleChoiceFilter(
-        queryset=Tag.objects.all(),
-        field_name='tags__slug',
-        to_field_name='slug')
+    tags = django_filters.filters.MultipleChoiceFilter(
+        field_name='tags__slug')
     is_favorited = django_filters.filters.NumberFilter(
         method='favorites_filter')
     is_in_shopping_cart = django_filters.filters.NumberFilter(
@@ -27,16 +65,30 @@ class RecipeFilter(django_filters.FilterSet):
         field_name='author',
         lookup_expr='exact'
     )
+    search = rest_framework.CharFilter(method='search_filter')
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        request = self.request
+        self.filters['tags'].extra['choices'] = lambda: tag_choices(request)
 
     def new_queryset(self, queryset, value, field):
         if self.request.user.is_anonymous:
-            return Recipe.objects.none()
-        obj = field.objects.filter(user=self.request.user)
-        recipes = [item.recipe.id for item in obj]
-        new_queryset = queryset.filter(id__in=recipes)
+            return queryset.none()
+        in_list = Exists(field.objects.filter(
+            user=self.request.user, recipe=OuterRef('pk')))
         if not value:
-            return queryset.difference(new_queryset)
-        return new_queryset
+            return queryset.filter(~in_list)
+        return queryset.filter(in_list)
+
+    def search_filter(self, queryset, name, value):
+        """Полнотекстовый поиск по названию, описанию и ингредиентам
+        с сортировкой по релевантности."""
+
+        query = SearchQuery(value, config='russian', search_type='websearch')
+        return queryset.filter(search_vector=query).annotate(
+            rank=SearchRank(F('search_vector'), query)
+        ).order_by('-rank', '-created')
 
     def favorites_filter(self, queryset, name, value):
         return self.new_queryset(queryset, value, Favorite)
@@ -0,0 +1,79 @@
+import io
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from PIL import Image, ImageOps
+from recipes.models import ModelVersion, Recipe
+
+from .background import submit
+from .postgresql.base import releasing_connections
+from .storage import DerivedFile
+
+image_executor = ThreadPoolExecutor(
+    max_workers=settings.RECIPE_IMAGE_WORKERS,
+    thread_name_prefix='recipe_image'
+)
+
+
+def variant_name(name, width):
+    """Имя WebP-копии заданной ширины рядом с оригиналом."""
+
+    return f'{os.path.splitext(name)[0]}_{width}.webp'
+
+
+def render_variants(name):
+    """Сохраняет WebP-копии оригинала name, не шире самого оригинала.
+
+    Возвращает список ширин созданных копий.
+    """
+    with default_storage.open(name) as file, Image.open(file) as original:
+        original.draft('RGB', (max(settings.RECIPE_IMAGE_WIDTHS),) * 2)
+        image = ImageOps.exif_transpose(original)
+        if image.mode not in ('RGB', 'RGBA'):
+            image = image.convert('RGBA' if 'transparency' in image.info
+                                  else 'RGB')
+        widths = []
+        for width in sorted(settings.RECIPE_IMAGE_WIDTHS):
+            if width > image.width:
+                break
+            height = max(1, round(image.height * width / image.width))
+            buffer = io.BytesIO()
+            image.resize((width, height), Image.LANCZOS).save(
+                buffer, 'WEBP', quality=settings.RECIPE_IMAGE_QUALITY,
+                method=4)
+            default_storage.save(
+                variant_name(name, width), DerivedFile(buffer.getvalue()))
+            widths.append(width)
+    return widths
+
+
+@releasing_connections
+def build_variants(recipe_id, name):
+    """Создаёт копии и отмечает их у рецепта, если фото не сменилось."""
+
+    widths = render_variants(name)
+    if Recipe.objects.filter(pk=recipe_id, image=name).update(
+            image_variants=widths):
+        ModelVersion.objects.bump(ModelVersion.objects.key_for(Recipe))
+
+
+def schedule_variants(recipe):
+    """Ставит в очередь обработку текущего фото рецепта."""
+
+    submit(image_executor, build_variants, recipe.pk, recipe.image.name)
+
+
+def variant_url(recipe, width, request=None):
+    url = default_storage.url(variant_name(recipe.image.name, width))
+    return request.build_absolute_uri(url) if request is not None else url
+
+
+def image_srcset(recipe, request=None):
+    """Значение srcset по готовым копиям; пусто, пока их нет."""
+
+    return ', '.join(
+        f'{variant_url(recipe, width, request)} {width}w'
+        for width in recipe.image_variants
+    )
@@ -0,0 +1,128 @@
+import mmap
+import os
+import struct
+import tempfile
+import time
+
+from django.conf import settings
+from recipes.models import Ingredient
+
+MAGIC = b'FGII'
+HEADER = struct.Struct('<4sQI')
+OFFSET = struct.Struct('<I')
+RECORD = struct.Struct('<IHH')
+
+
+class IngredientIndex:
+    """Префиксный индекс названий ингредиентов в memory-mapped файле.
+
+    Файл содержит заголовок (метка версии, число записей), таблицу
+    смещений и записи (id, название, единица измерения), отсортированные
+    по байтам названия в UTF-8. Все воркеры gunicorn отображают один и тот
+    же файл; при изменении ингредиентов файл удаляется, пересобирается
+    при следующем запросе и атомарно подменяется, а воркеры по inode
+    и mtime замечают подмену и переотображают его.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.stamp = None
+        self._buffer = None
+        self._file_id = None
+        self._count = 0
+        self._data_start = 0
+
+    def build(self):
+        """Собирает индекс из базы и атомарно подменяет файл."""
+
+        records = sorted(
+            (name.encode(), pk, measurement_unit.encode())
+            for pk, name, measurement_unit
+            in Ingredient.objects.order_by().values_list(
+                'id', 'name', 'measurement_unit').iterator()
+        )
+        offsets = []
+        data = bytearray()
+        for name, pk, measurement_unit in records:
+            offsets.append(len(data))
+            data += RECORD.pack(pk, len(name), len(measurement_unit))
+            data += name + measurement_unit
+        directory = os.path.dirname(self.path)
+        os.makedirs(directory, exist_ok=True)
+        descriptor, tmp_path = tempfile.mkstemp(dir=directory)
+        with os.fdopen(descriptor, 'wb') as file:
+            file.write(HEADER.pack(MAGIC, time.time_ns(), len(records)))
+            file.write(struct.pack(f'<{len(offsets)}I', *offsets))
+            file.write(data)
+        os.replace(tmp_path, self.path)
+
+    def invalidate(self):
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+    def _refresh(self):
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            self.build()
+            return self._refresh()
+        if (stat.st_ino, stat.st_mtime_ns) == self._file_id:
+            return
+        try:
+            with open(self.path, 'rb') as file:
+                stat = os.fstat(file.fileno())
+                buffer = mmap.mmap(
+                    file.fileno(), 0, access=mmap.ACCESS_READ)
+        except FileNotFoundError:
+            return self._refresh()
+        file_id = (stat.st_ino, stat.st_mtime_ns)
+        magic, stamp, count = HEADER.unpack_from(buffer)
+        if magic != MAGIC:
+            raise ValueError(f'{self.path} не является индексом ингредиентов')
+        self._buffer = buffer
+        self._file_id = file_id
+        self._count = count
+        self._data_start = HEADER.size + OFFSET.size * count
+        self.stamp = stamp
+
+    def _record(self, position):
+        (offset,) = OFFSET.unpack_from(
+            self._buffer, HEADER.size + OFFSET.size * position)
+        start = self._data_start + offset
+        pk, name_length, unit_length = RECORD.unpack_from(self._buffer, start)
+        start += RECORD.size
+        name = self._buffer[start:start + name_length]
+        start += name_length
+        return pk, name, self._buffer[start:start + unit_length]
+
+    def _lower_bound(self, key):
+        low, high = 0, self._count
+        while low < high:
+            middle = (low + high) // 2
+            if self._record(middle)[1] < key:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def search(self, prefix):
+        """Ингредиенты, название которых начинается с prefix."""
+
+        self._refresh()
+        key = prefix.encode()
+        results = []
+        for position in range(self._lower_bound(key), self._count):
+            pk, name, measurement_unit = self._record(position)
+            if not name.startswith(key):
+                break
+            results.append({
+                'id': pk,
+                'name': name.decode(),
+                'measurement_unit': measurement_unit.decode(),
+            })
+        return results
+
+
+ingredient_index = IngredientIndex(settings.INGREDIENT_INDEX_PATH)
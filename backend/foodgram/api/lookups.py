@@ -0,0 +1,33 @@
+from django.db.models import FloatField, Func, Value
+from django.db.models.lookups import Contains, PostgresOperatorLookup
+
+
+class TrigramWordSimilar(PostgresOperatorLookup):
+    """Поиск слова по триграммам (оператор %> из pg_trgm)."""
+
+    lookup_name = 'trigram_word_similar'
+    postgres_operator = '%%>'
+
+
+class TrigramWordSimilarity(Func):
+    """Наибольшее сходство строки с фрагментом поля (word_similarity)."""
+
+    function = 'WORD_SIMILARITY'
+    output_field = FloatField()
+
+    def __init__(self, string, expression, **extra):
+        if not hasattr(string, 'resolve_expression'):
+            string = Value(string)
+        super().__init__(string, expression, **extra)
+
+
+class TrigramIContains(Contains):
+    """Подстрока без учёта регистра через ILIKE. Стандартный icontains
+    сравнивает UPPER(поле) и не использует триграммный индекс поля."""
+
+    lookup_name = 'trigram_icontains'
+
+    def as_postgresql(self, compiler, connection):
+        lhs_sql, lhs_params = self.process_lhs(compiler, connection)
+        rhs_sql, rhs_params = self.process_rhs(compiler, connection)
+        return f'{lhs_sql} ILIKE {rhs_sql}', (*lhs_params, *rhs_params)
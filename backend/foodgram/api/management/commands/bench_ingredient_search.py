@@ -0,0 +1,63 @@
+import random
+import statistics
+import time
+
+from api.filters import IngredientFilter
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from recipes.models import Ingredient
+
+TERMS = ('молоко', 'малако', 'сгущ', 'мука пшен', 'сыр', 'ябл')
+
+
+class Command(BaseCommand):
+    help = ('Замеряет задержку нечёткого поиска ингредиентов в зависимости '
+            'от размера справочника. Синтетические данные откатываются.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--sizes', nargs='+', type=int,
+            default=(2188, 20000, 200000),
+            help='Размеры справочника для замеров.'
+        )
+        parser.add_argument(
+            '--repeat', type=int, default=20,
+            help='Повторов каждого поискового запроса.'
+        )
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            self.run(sorted(options['sizes']), options['repeat'])
+            transaction.set_rollback(True)
+
+    def run(self, sizes, repeat):
+        words = sorted({
+            word for name in Ingredient.objects.values_list('name', flat=True)
+            for word in name.split() if word.isalpha()
+        }) or ['ингредиент']
+        generator = random.Random(0)
+        total = Ingredient.objects.count()
+        self.stdout.write('size\tp50, ms\tp95, ms')
+        for size in sizes:
+            Ingredient.objects.bulk_create(
+                (Ingredient(
+                    name=(f'{generator.choice(words)} '
+                          f'{generator.choice(words)} {number}'),
+                    measurement_unit='г')
+                 for number in range(total, size)),
+                batch_size=5000
+            )
+            total = max(total, size)
+            with connection.cursor() as cursor:
+                cursor.execute('ANALYZE recipes_ingredient')
+            timings = []
+            for term in TERMS * repeat:
+                start = time.perf_counter()
+                list(IngredientFilter(
+                    {'search': term}, queryset=Ingredient.objects.all()).qs)
+                timings.append((time.perf_counter() - start) * 1000)
+            timings.sort()
+            self.stdout.write(
+                f'{total}\t{statistics.median(timings):.2f}\t'
+                f'{timings[int(len(timings) * 0.95) - 1]:.2f}'
+            )
@@ -0,0 +1,72 @@
+import json
+import time
+from base64 import urlsafe_b64encode
+
+from api.paginations import CustomPagination
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from recipes.models import Recipe
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+from users.models import User
+
+
+class Command(BaseCommand):
+    help = ('Сравнивает время выдачи N-й страницы рецептов при постраничной '
+            'и keyset-пагинации. Синтетические данные откатываются.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--recipes', type=int, default=50000,
+            help='Сколько рецептов создать для замера.'
+        )
+        parser.add_argument(
+            '--repeat', type=int, default=5,
+            help='Повторов каждого замера.'
+        )
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            self.run(options['recipes'], options['repeat'])
+            transaction.set_rollback(True)
+
+    def timed(self, page_number, cursor, repeat):
+        factory = APIRequestFactory()
+        params = ({'page': page_number} if cursor is None
+                  else {'cursor': cursor})
+        timings = []
+        for _ in range(repeat):
+            request = Request(factory.get(
+                '/api/recipes/', params, SERVER_NAME='localhost'))
+            start = time.perf_counter()
+            CustomPagination().paginate_queryset(
+                Recipe.objects.all(), request)
+            timings.append((time.perf_counter() - start) * 1000)
+        return min(timings)
+
+    def run(self, total, repeat):
+        author = User.objects.create(
+            email='bench@foodgram.local', username='bench_pagination')
+        Recipe.objects.bulk_create(
+            (Recipe(author=author, name=f'bench_pagination_{number}',
+                    image='recipes/bench.png', text='bench', cooking_time=1)
+             for number in range(total)),
+            batch_size=5000
+        )
+        page_size = CustomPagination.page_size
+        ordered = Recipe.objects.order_by(*CustomPagination.keyset_fields)
+        self.stdout.write('page\toffset, ms\tkeyset, ms')
+        page_number = 1
+        while (page_number - 1) * page_size < total:
+            cursor = ''
+            if page_number > 1:
+                last = ordered.values_list('created', 'id')[
+                    (page_number - 1) * page_size - 1]
+                cursor = urlsafe_b64encode(
+                    json.dumps(last, default=str).encode()).decode()
+            self.stdout.write(
+                f'{page_number}\t'
+                f'{self.timed(page_number, None, repeat):.2f}\t\t'
+                f'{self.timed(page_number, cursor, repeat):.2f}'
+            )
+            page_number *= 10
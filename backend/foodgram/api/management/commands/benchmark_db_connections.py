@@ -0,0 +1,57 @@
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.core.signals import request_finished, request_started
+from django.db import connection
+from recipes.models import Tag
+
+
+class Command(BaseCommand):
+    help = ('Сравнивает время запроса к базе с новым соединением на каждый '
+            'запрос и с постоянным соединением.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--requests', type=int, default=500,
+            help='Число имитируемых запросов в каждом режиме.'
+        )
+        parser.add_argument(
+            '--max-age', type=int, default=60,
+            help='CONN_MAX_AGE для режима с постоянным соединением.'
+        )
+
+    def handle(self, *args, **options):
+        max_age = connection.settings_dict['CONN_MAX_AGE']
+        try:
+            results = {
+                mode: self.measure(age, options['requests'])
+                for mode, age in (('новое', 0),
+                                  ('постоянное', options['max_age']))
+            }
+        finally:
+            connection.close()
+            connection.settings_dict['CONN_MAX_AGE'] = max_age
+        for mode, timings in results.items():
+            self.stdout.write(
+                f'{mode}: среднее {statistics.mean(timings):.3f} мс, '
+                f'медиана {statistics.median(timings):.3f} мс')
+        saved = (statistics.median(results['новое'])
+                 - statistics.median(results['постоянное']))
+        self.stdout.write(self.style.SUCCESS(
+            f'Экономия на запрос: {saved:.3f} мс'))
+
+    def measure(self, max_age, requests):
+        """Время цикла запроса в мс: сигналы начала и конца запроса
+        закрывают соединение так же, как при обработке HTTP-запроса."""
+
+        connection.close()
+        connection.settings_dict['CONN_MAX_AGE'] = max_age
+        timings = []
+        for _ in range(requests):
+            start = time.perf_counter()
+            request_started.send(sender=self.__class__)
+            list(Tag.objects.all()[:1])
+            request_finished.send(sender=self.__class__)
+            timings.append((time.perf_counter() - start) * 1000)
+        return timings
@@ -0,0 +1,35 @@
+from api.images import render_variants
+from django.core.management.base import BaseCommand
+from recipes.models import ModelVersion, Recipe
+
+
+class Command(BaseCommand):
+    help = ('Создаёт уменьшенные WebP-копии фото рецептов, у которых их '
+            'ещё нет (или у всех с --all).')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--all',
+            action='store_true',
+            help='Пересоздать копии у всех рецептов.'
+        )
+
+    def handle(self, *args, **options):
+        recipes = Recipe.objects.order_by('id')
+        if not options['all']:
+            recipes = recipes.filter(image_variants=[])
+        built = failed = 0
+        for pk, name in recipes.values_list('id', 'image').iterator():
+            try:
+                widths = render_variants(name)
+            except OSError as error:
+                failed += 1
+                self.stderr.write(f'Рецепт {pk}: {error}')
+                continue
+            if widths and Recipe.objects.filter(pk=pk, image=name).update(
+                    image_variants=widths):
+                built += 1
+        if built:
+            ModelVersion.objects.bump(ModelVersion.objects.key_for(Recipe))
+        self.stdout.write(self.style.SUCCESS(
+            f'Копии созданы для {built} рецептов, ошибок: {failed}'))
@@ -0,0 +1,11 @@
+from api.ingredient_index import ingredient_index
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = 'Пересобирает префиксный индекс ингредиентов для автодополнения.'
+
+    def handle(self, *args, **options):
+        ingredient_index.build()
+        self.stdout.write(self.style.SUCCESS(
+            f'Индекс ингредиентов записан в {ingredient_index.path}'))
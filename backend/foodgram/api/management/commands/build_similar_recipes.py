@@ -0,0 +1,66 @@
+import time
+from itertools import islice
+
+from api.bulk import CopyStream
+from api.similar import build_similar
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from recipes.models import ModelVersion, Recipe, SimilarRecipe
+
+CHUNK_SIZE = 1 << 16
+
+
+class Command(BaseCommand):
+    help = ('Пересчитывает похожие рецепты по матрице рецепт x ингредиент '
+            'и заменяет ими таблицу.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=10000,
+            help='Строк в одной вставке bulk_create.'
+        )
+        parser.add_argument(
+            '--no-copy', action='store_true',
+            help='Писать через bulk_create даже на PostgreSQL.'
+        )
+
+    def handle(self, *args, **options):
+        self.total = 0
+        start = time.perf_counter()
+        rows = self.count(
+            (recipe_id, pk, score)
+            for recipe_id, neighbours in build_similar()
+            for pk, score in neighbours
+        )
+        with transaction.atomic():
+            SimilarRecipe.objects.all().delete()
+            if connection.vendor == 'postgresql' and not options['no_copy']:
+                self.copy(rows)
+            else:
+                self.bulk_create(rows, options['batch_size'])
+            ModelVersion.objects.bump(ModelVersion.objects.key_for(Recipe))
+        self.stdout.write(self.style.SUCCESS(
+            f'Сохранено {self.total} пар похожих рецептов за '
+            f'{time.perf_counter() - start:.2f} с'))
+
+    def count(self, rows):
+        for row in rows:
+            self.total += 1
+            yield row
+
+    def copy(self, rows):
+        with connection.cursor() as cursor:
+            cursor.copy_expert(
+                f'COPY {SimilarRecipe._meta.db_table} '
+                '(recipe_id, similar_id, score) FROM STDIN WITH (FORMAT csv)',
+                CopyStream(rows), size=CHUNK_SIZE)
+
+    def bulk_create(self, rows, batch_size):
+        while True:
+            batch = [
+                SimilarRecipe(recipe_id=recipe_id, similar_id=pk, score=score)
+                for recipe_id, pk, score in islice(rows, batch_size)
+            ]
+            if not batch:
+                return
+            SimilarRecipe.objects.bulk_create(batch)
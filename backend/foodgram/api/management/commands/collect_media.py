@@ -0,0 +1,112 @@
+import os
+import re
+from datetime import timedelta
+
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from recipes.models import StoredFile
+
+DIRECTORY = 'recipes'
+# Уменьшенная копия: <имя оригинала без расширения>_<ширина>.webp.
+VARIANT_NAME = re.compile(r'^(.+)_\d+\.webp$')
+
+
+def stem(file_name):
+    return os.path.splitext(os.path.basename(file_name))[0]
+
+
+def owner_stems(file_name):
+    """Имя файла без расширения и, если файл похож на копию, имя
+    её оригинала."""
+
+    stems = {stem(file_name)}
+    match = VARIANT_NAME.match(os.path.basename(file_name))
+    if match:
+        stems.add(match[1])
+    return stems
+
+
+class Command(BaseCommand):
+    help = ('Удаляет из хранилища фото без ссылок вместе с уменьшенными '
+            'копиями и старые файлы, которых нет в учёте ссылок.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--grace', type=int, default=60,
+            help='Не трогать файлы, изменённые за последние N минут.'
+        )
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Только показать, что будет удалено.'
+        )
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            removed, freed = self.collect(
+                timezone.now() - timedelta(minutes=options['grace']),
+                options['dry_run'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Удалено файлов: {removed}, освобождено {freed} байт'
+            + (' (пробный запуск)' if options['dry_run'] else '')
+        ))
+
+    def collect(self, cutoff, dry_run):
+        """Удаляет файлы под блокировкой их записей StoredFile.
+
+        Записи, которые держит сохранение того же файла, пропускаются, а
+        оригинал без записи перед удалением получает свою: сохранение,
+        которое успело найти файл, эту запись уже создало.
+        """
+        released = {
+            stem(stored.name): stored
+            for stored in StoredFile.objects.select_for_update(
+                skip_locked=True).filter(references=0, updated__lt=cutoff)
+        }
+        live_stems = {
+            stem(name)
+            for name in StoredFile.objects.values_list('name', flat=True)
+        } - released.keys()
+        removed = freed = 0
+        for file_name in default_storage.listdir(DIRECTORY)[1]:
+            name = f'{DIRECTORY}/{file_name}'
+            stems = owner_stems(file_name)
+            if stems & live_stems:
+                continue
+            owners = [released[key] for key in stems & released.keys()]
+            if not owners and (
+                    default_storage.get_modified_time(name) >= cutoff
+                    or not dry_run and not VARIANT_NAME.match(file_name)
+                    and not self.claim(name, released)):
+                continue
+            if not all(self.unreferenced(owner) for owner in owners):
+                continue
+            removed += 1
+            freed += default_storage.size(name)
+            self.stdout.write(name)
+            if not dry_run:
+                default_storage.delete(name)
+        if not dry_run:
+            StoredFile.objects.filter(
+                pk__in=[stored.pk for stored in released.values()]
+            ).delete()
+        return removed, freed
+
+    @staticmethod
+    def claim(name, released):
+        """Заводит запись для файла без учёта ссылок; False, если запись
+        уже появилась."""
+
+        try:
+            with transaction.atomic():
+                stored = StoredFile.objects.create(name=name)
+        except IntegrityError:
+            return False
+        released[stem(name)] = stored
+        return True
+
+    @staticmethod
+    def unreferenced(stored):
+        stored.refresh_from_db(fields=('references',))
+        return stored.references == 0
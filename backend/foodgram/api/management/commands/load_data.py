@@ -0,0 +1,180 @@
+import csv
+import json
+import os
+import time
+from itertools import islice
+
+from api.bulk import CopyStream
+from api.ingredient_index import ingredient_index
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from recipes.models import Ingredient, ModelVersion, Tag
+
+CHUNK_SIZE = 1 << 16
+FIELD_LENGTH = Ingredient._meta.get_field('name').max_length
+
+
+def read_csv(file):
+    """Строки (название, единица) из CSV без заголовка."""
+
+    for line, row in enumerate(csv.reader(file), start=1):
+        if not row:
+            continue
+        if len(row) != 2:
+            raise CommandError(f'Строка {line}: ожидается 2 столбца')
+        yield row
+
+
+def read_json_array(file):
+    """Элементы JSON-массива верхнего уровня по одному, без чтения файла
+    целиком."""
+
+    decoder = json.JSONDecoder()
+    buffer, position, opened = '', 0, False
+    for chunk in iter(lambda: file.read(CHUNK_SIZE), ''):
+        buffer = buffer[position:] + chunk
+        position = 0
+        while True:
+            while position < len(buffer) and buffer[position] in ' \t\r\n,':
+                position += 1
+            if position == len(buffer):
+                break
+            if not opened:
+                if buffer[position] != '[':
+                    raise CommandError('Ожидается JSON-массив')
+                opened = True
+                position += 1
+                continue
+            if buffer[position] == ']':
+                return
+            try:
+                item, position = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                break
+            yield item
+    raise CommandError('Некорректный или незавершённый JSON')
+
+
+class Command(BaseCommand):
+    help = ('Потоково загружает ингредиенты из CSV или JSON (в том числе '
+            'dump.json). Повторная загрузка не создаёт дублей.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'paths', nargs='*',
+            default=(os.path.join(settings.CSV_FILES_DIR, 'ingredients.csv'),),
+            help='Файлы .csv или .json.'
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=10000,
+            help='Строк в пачке и между сообщениями о прогрессе.'
+        )
+        parser.add_argument(
+            '--no-copy', action='store_true',
+            help='Писать через bulk_create даже на PostgreSQL.'
+        )
+
+    def handle(self, *args, **options):
+        self.batch_size = options['batch_size']
+        self.tags = []
+        self.read = 0
+        self.start = time.perf_counter()
+        use_copy = connection.vendor == 'postgresql' and not options['no_copy']
+        before = Ingredient.objects.count()
+        with transaction.atomic():
+            for path in options['paths']:
+                rows = self.progress(self.ingredient_rows(path))
+                if use_copy:
+                    self.copy(rows)
+                else:
+                    self.bulk_create(rows)
+            if self.tags:
+                Tag.objects.bulk_create(self.tags, ignore_conflicts=True)
+                ModelVersion.objects.bump(ModelVersion.objects.key_for(Tag))
+            ModelVersion.objects.bump(
+                ModelVersion.objects.key_for(Ingredient))
+            transaction.on_commit(ingredient_index.build)
+        elapsed = time.perf_counter() - self.start
+        self.stdout.write(self.style.SUCCESS(
+            f'Прочитано {self.read}, добавлено '
+            f'{Ingredient.objects.count() - before} ингредиентов, '
+            f'{len(self.tags)} тегов за {elapsed:.2f} с '
+            f'({self.read / max(elapsed, 1e-9):.0f} строк/с)'
+        ))
+
+    def ingredient_rows(self, path):
+        try:
+            file = open(path, encoding='utf-8', newline='')
+        except OSError as error:
+            raise CommandError(error)
+        with file:
+            if path.endswith('.csv'):
+                rows = read_csv(file)
+            elif path.endswith('.json'):
+                rows = self.json_rows(read_json_array(file))
+            else:
+                raise CommandError(f'{path}: поддерживаются .csv и .json')
+            for name, measurement_unit in rows:
+                name, measurement_unit = name.strip(), measurement_unit.strip()
+                if not name or not measurement_unit:
+                    continue
+                if max(len(name), len(measurement_unit)) > FIELD_LENGTH:
+                    raise CommandError(
+                        f'{path}: длиннее {FIELD_LENGTH} символов: {name}')
+                yield name, measurement_unit
+
+    def json_rows(self, items):
+        """Ингредиенты из JSON-списка или фикстуры; теги фикстуры
+        откладываются до конца загрузки."""
+
+        for item in items:
+            model = item.get('model')
+            if model == 'recipes.tag':
+                self.tags.append(Tag(**item['fields']))
+                continue
+            if model not in (None, 'recipes.ingredient'):
+                continue
+            fields = item['fields'] if model else item
+            yield fields['name'], fields['measurement_unit']
+
+    def progress(self, rows):
+        for row in rows:
+            self.read += 1
+            if self.read % self.batch_size == 0:
+                elapsed = time.perf_counter() - self.start
+                self.stdout.write(
+                    f'{self.read} строк, {self.read / elapsed:.0f} строк/с')
+            yield row
+
+    def copy(self, rows):
+        """COPY во временную таблицу и INSERT ... ON CONFLICT DO NOTHING.
+
+        Строки вставляются отсортированными, чтобы вставка в индексы по
+        названию шла последовательно, а не в случайные страницы.
+        """
+
+        table = Ingredient._meta.db_table
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'CREATE TEMP TABLE ingredient_load '
+                '(name text, measurement_unit text) ON COMMIT DROP')
+            cursor.copy_expert(
+                'COPY ingredient_load FROM STDIN WITH (FORMAT csv)',
+                CopyStream(rows), size=CHUNK_SIZE)
+            cursor.execute(
+                f'INSERT INTO {table} (name, measurement_unit) '
+                'SELECT DISTINCT name, measurement_unit FROM ingredient_load '
+                'ORDER BY name, measurement_unit '
+                'ON CONFLICT (name, measurement_unit) DO NOTHING')
+            cursor.execute('DROP TABLE ingredient_load')
+
+    def bulk_create(self, rows):
+        while True:
+            batch = [
+                Ingredient(name=name, measurement_unit=measurement_unit)
+                for name, measurement_unit in islice(rows, self.batch_size)
+            ]
+            if not batch:
+                return
+            Ingredient.objects.bulk_create(batch, ignore_conflicts=True)
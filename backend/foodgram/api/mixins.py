@@ -1,6 +1,124 @@
+from hashlib import md5
+
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date, quote_etag
+from recipes.models import ModelVersion
 from rest_framework.mixins import ListModelMixin, RetrieveModelMixin
+from rest_framework.response import Response
 from rest_framework.viewsets import GenericViewSet
 
+from .cache import get_model_versions, response_cache
+
+
+class ModelVersionMixin:
+    """Счётчики ModelVersion, от которых зависит ответ вьюсета."""
+
+    version_models = ()
+    user_version_models = ()
+
+    def get_version_keys(self):
+        keys = [ModelVersion.objects.key_for(model)
+                for model in self.version_models]
+        user = self.request.user
+        if user.is_authenticated:
+            keys += [ModelVersion.objects.key_for(model, user.id)
+                     for model in self.user_version_models]
+        return keys
+
+    def get_model_versions(self):
+        return get_model_versions(self.request, self.get_version_keys())
+
+
+class ConditionalGetMixin(ModelVersionMixin):
+    """ETag и Last-Modified для list и retrieve.
+
+    Валидаторы собираются из счётчиков ModelVersion (version_models -
+    общие, user_version_models - данные текущего пользователя) и
+    get_extra_validators() до сериализации, поэтому ответ 304 не
+    запрашивает и не сериализует сами объекты.
+    """
+
+    def get_extra_validators(self):
+        """Дополнительные (значение, дата изменения) для наследников."""
+
+        return (), None
+
+    def get_validators(self):
+        versions = self.get_model_versions()
+        extra, last_modified = self.get_extra_validators()
+        dates = [updated for _, updated in versions.values()]
+        if last_modified is not None:
+            dates.append(last_modified)
+        etag = md5(repr((
+            sorted(versions.items()),
+            extra,
+            self.request.user.id,
+            self.request.get_full_path(),
+            self.request.accepted_renderer.format,
+        )).encode()).hexdigest()
+        return quote_etag(etag), max(dates, default=None)
+
+    def conditional_response(self, handler, request, *args, **kwargs):
+        etag, last_modified = self.get_validators()
+        timestamp = last_modified and int(last_modified.timestamp())
+        response = get_conditional_response(
+            request, etag=etag, last_modified=timestamp)
+        if response is None:
+            response = handler(request, *args, **kwargs)
+        if response.status_code in (200, 304):
+            response['ETag'] = etag
+            if timestamp:
+                response['Last-Modified'] = http_date(timestamp)
+            patch_vary_headers(response, ('Authorization',))
+        return response
+
+    def list(self, request, *args, **kwargs):
+        return self.conditional_response(
+            super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.conditional_response(
+            super().retrieve, request, *args, **kwargs)
+
+
+class CachedResponseMixin(ModelVersionMixin):
+    """Кэширование данных ответов list и retrieve.
+
+    В ключ входят путь запроса, формат и версии моделей, поэтому запись
+    становится недоступной сразу после изменения данных, без TTL.
+    При cache_anonymous_only ответы авторизованным пользователям,
+    зависящие от их избранного и подписок, не кэшируются.
+    """
+
+    cache_anonymous_only = False
+
+    def cached_response(self, handler, request, *args, **kwargs):
+        if self.cache_anonymous_only and request.user.is_authenticated:
+            return handler(request, *args, **kwargs)
+        key = response_cache.make_key(
+            self.basename,
+            (self.action, request.get_full_path(),
+             request.accepted_renderer.format),
+            self.get_model_versions()
+        )
+        data = response_cache.get(key)
+        if data is not None:
+            response = Response(data)
+            response['X-Cache'] = 'HIT'
+            return response
+        response = handler(request, *args, **kwargs)
+        if response.status_code == 200:
+            response_cache.set(key, response.data)
+        response['X-Cache'] = 'MISS'
+        return response
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(
+            super().retrieve, request, *args, **kwargs)
+
 
 class ListRetriveViewSet(ListModelMixin, RetrieveModelMixin, GenericViewSet):
     pass
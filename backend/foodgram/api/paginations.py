@@ -1,7 +1,146 @@
-from rest_framework.pagination import PageNumberPagination
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from binascii import Error as BinasciiError
 
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import (LimitOffsetPagination,
+                                       PageNumberPagination)
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
 
-class CustomPagination(PageNumberPagination):
+
+class KeysetPaginationMixin:
+    """Необязательная keyset-пагинация (курсор).
+
+    Включается параметром ?cursor= (пустой курсор - первая страница).
+    Следующая страница выбирается условием по полям keyset_fields от
+    последней записи текущей, без COUNT(*) и OFFSET, поэтому время
+    ответа не растёт с номером страницы. Без параметра cursor работает
+    обычная пагинация и прежний формат ответа; при keyset_only курсор
+    используется всегда. Выборка, уже упорядоченная явно (например, по
+    рангу поиска ?search), разбивается обычной пагинацией: курсор по
+    keyset_fields этот порядок потерял бы.
+    """
+
+    cursor_query_param = 'cursor'
+    keyset_fields = ('id',)
+    keyset_only = False
+    invalid_cursor_message = 'Неверный курсор.'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.keyset = (
+            (self.keyset_only
+             or self.cursor_query_param in request.query_params)
+            and not queryset.query.order_by
+        )
+        if not self.keyset:
+            return super().paginate_queryset(queryset, request, view)
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        page_size = self.get_keyset_page_size(request)
+        queryset = queryset.order_by(*self.keyset_fields)
+        position = self.decode_cursor(request, queryset)
+        if position is not None:
+            queryset = queryset.filter(self.keyset_filter(position))
+        page = list(queryset[:page_size + 1])
+        self.has_next = len(page) > page_size
+        page = page[:page_size]
+        self.next_position = (
+            [getattr(page[-1], field.lstrip('-'))
+             for field in self.keyset_fields]
+            if self.has_next else None
+        )
+        return page
+
+    def get_keyset_page_size(self, request):
+        if isinstance(self, LimitOffsetPagination):
+            return self.get_limit(request)
+        return self.get_page_size(request)
+
+    def keyset_output_fields(self, queryset):
+        """Поля модели или аннотаций выборки для keyset_fields."""
+
+        for field in self.keyset_fields:
+            name = field.lstrip('-')
+            if name in queryset.query.annotations:
+                yield queryset.query.annotations[name].output_field
+            else:
+                yield queryset.model._meta.get_field(name)
+
+    def keyset_filter(self, position):
+        """(a, b) после (x, y): a > x ИЛИ (a = x И b > y)."""
+
+        condition = Q()
+        for index, field in enumerate(self.keyset_fields):
+            name = field.lstrip('-')
+            lookup = 'lt' if field.startswith('-') else 'gt'
+            equal = {
+                previous.lstrip('-'): value for previous, value
+                in zip(self.keyset_fields[:index], position[:index])
+            }
+            condition |= Q(**{f'{name}__{lookup}': position[index]}, **equal)
+        return condition
+
+    def decode_cursor(self, request, queryset):
+        """Значения курсора, приведённые к типам полей выборки."""
+
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            position = json.loads(urlsafe_b64decode(encoded.encode()))
+        except (BinasciiError, UnicodeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+        if (not isinstance(position, list)
+                or len(position) != len(self.keyset_fields)
+                or not all(isinstance(value, (str, int, float))
+                           for value in position)):
+            raise NotFound(self.invalid_cursor_message)
+        try:
+            return [
+                field.to_python(value) for field, value
+                in zip(self.keyset_output_fields(queryset), position)
+            ]
+        except (ValidationError, TypeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def encode_cursor(self, position):
+        encoded = urlsafe_b64encode(
+            json.dumps(position, default=str).encode()).decode()
+        return replace_query_param(
+            self.base_url, self.cursor_query_param, encoded)
+
+    def get_paginated_response(self, data):
+        if not self.keyset:
+            return super().get_paginated_response(data)
+        return Response({
+            'next': (self.encode_cursor(self.next_position)
+                     if self.has_next else None),
+            'results': data,
+        })
+
+
+class CustomPagination(KeysetPaginationMixin, PageNumberPagination):
+
+    page_size_query_param = 'limit'
+    page_size = 6
+    keyset_fields = ('-created', '-id')
+
+
+class UserPagination(KeysetPaginationMixin, LimitOffsetPagination):
+
+    keyset_fields = ('id',)
+
+
+class FeedPagination(CustomPagination):
+
+    keyset_only = True
+    keyset_fields = ('-feed_created', '-id')
+
+
+class PantryPagination(PageNumberPagination):
 
     page_size_query_param = 'limit'
     page_size = 6
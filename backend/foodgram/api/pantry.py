@@ -0,0 +1,184 @@
+import copy
+import threading
+from collections import namedtuple
+from datetime import timedelta
+
+import numpy as np
+from django.conf import settings
+from django.db.models import Max
+from recipes.models import (Ingredient, IngredientInRecipe, ModelVersion,
+                            Recipe, Tag)
+
+from .cache import get_model_versions
+
+RecipeTag = Recipe.tags.through
+# Запас при выборке изменённых рецептов: транзакция могла начаться
+# раньше последней синхронизации, а зафиксироваться позже.
+UPDATE_MARGIN = timedelta(minutes=1)
+
+PantryMatches = namedtuple('PantryMatches', 'ids coverage missing')
+
+
+def postings(positions, keys):
+    """Инвертированный список ключ -> позиции: отсортированные ключи,
+    границы и позиции, как в CSC-матрице."""
+
+    order = np.lexsort((positions, keys))
+    keys, starts = np.unique(keys[order], return_index=True)
+    return keys, np.append(starts, len(order)), positions[order]
+
+
+def id_pairs(queryset, *fields):
+    return np.array(
+        list(queryset.values_list(*fields).iterator()), dtype=np.int64
+    ).reshape(-1, 2)
+
+
+def lookup(keys, indptr, indices, wanted):
+    """Позиции по всем найденным ключам из wanted, одним массивом."""
+
+    found = np.searchsorted(keys, wanted)
+    found = found[found < len(keys)]
+    found = found[np.isin(keys[found], wanted)]
+    if not len(found):
+        return np.empty(0, dtype=np.int64)
+    return np.concatenate(
+        [indices[indptr[index]:indptr[index + 1]] for index in found])
+
+
+class PantryState:
+    """Неизменяемый снимок индекса: основа и дельта изменённых рецептов.
+
+    Основа - отсортированные id рецептов с числом ингредиентов
+    и инвертированные списки ингредиент -> позиции рецептов (и так же
+    для тегов). Изменённые после сборки рецепты помечаются в основе
+    удалёнными и хранятся в дельте как множества ингредиентов и тегов.
+    """
+
+    def __init__(self):
+        pairs = id_pairs(
+            IngredientInRecipe.objects, 'recipe_id', 'ingredient_id')
+        self.recipe_ids, positions = np.unique(
+            pairs[:, 0], return_inverse=True)
+        self.sizes = np.bincount(positions, minlength=len(self.recipe_ids))
+        self.ingredients = postings(positions, pairs[:, 1])
+        pairs = id_pairs(RecipeTag.objects, 'recipe_id', 'tag_id')
+        pairs = pairs[np.isin(pairs[:, 0], self.recipe_ids)]
+        self.tags = postings(
+            np.searchsorted(self.recipe_ids, pairs[:, 0]), pairs[:, 1])
+        self.dead = np.zeros(len(self.recipe_ids), dtype=bool)
+        self.delta = {}
+        self.known_ids = set(Recipe.objects.values_list('id', flat=True))
+        self.since = self.last_update()
+        self.slugs = dict(Tag.objects.values_list('slug', 'id'))
+
+    @staticmethod
+    def last_update():
+        updated = Recipe.objects.aggregate(updated=Max('updated'))['updated']
+        return updated and updated - UPDATE_MARGIN
+
+    def updated(self):
+        """Новый снимок с рецептами, изменёнными или удалёнными после
+        прошлой синхронизации."""
+
+        state = copy.copy(self)
+        state.dead = self.dead.copy()
+        state.delta = dict(self.delta)
+        state.known_ids = set(self.known_ids)
+        state.slugs = dict(Tag.objects.values_list('slug', 'id'))
+        changed = Recipe.objects.all()
+        if self.since is not None:
+            changed = changed.filter(updated__gte=self.since)
+        changed = list(changed.values_list('id', flat=True))
+        state.since = self.last_update()
+        state.known_ids.update(changed)
+        entries = {pk: (set(), set()) for pk in changed}
+        for recipe_id, ingredient_id in IngredientInRecipe.objects.filter(
+                recipe_id__in=changed).values_list(
+                'recipe_id', 'ingredient_id'):
+            entries[recipe_id][0].add(ingredient_id)
+        for recipe_id, tag_id in RecipeTag.objects.filter(
+                recipe_id__in=changed).values_list('recipe_id', 'tag_id'):
+            entries[recipe_id][1].add(tag_id)
+        removed = []
+        if Recipe.objects.count() != len(state.known_ids):
+            current = set(Recipe.objects.values_list('id', flat=True))
+            removed = list(state.known_ids - current)
+            state.known_ids = current
+        for pk in removed:
+            entries[pk] = (set(), set())
+        for pk, entry in entries.items():
+            state.delta[pk] = entry
+        state.dead[np.isin(state.recipe_ids, list(entries))] = True
+        return state
+
+    def search(self, ingredient_ids, tag_ids):
+        """Рецепты по убыванию доли имеющихся ингредиентов, затем по
+        возрастанию числа недостающих.
+
+        Рецепт должен содержать хотя бы один ингредиент из
+        ingredient_ids и, если заданы теги, хотя бы один из tag_ids.
+        """
+        wanted = np.unique(np.array(ingredient_ids, dtype=np.int64))
+        owned = np.bincount(
+            lookup(*self.ingredients, wanted), minlength=len(self.recipe_ids))
+        keep = (owned > 0) & ~self.dead
+        if tag_ids:
+            tagged = np.zeros(len(self.recipe_ids), dtype=bool)
+            tagged[lookup(*self.tags, np.array(tag_ids, dtype=np.int64))] = 1
+            keep &= tagged
+        ids = [self.recipe_ids[keep]]
+        counts = [owned[keep]]
+        sizes = [self.sizes[keep]]
+        pantry, tag_ids = set(wanted.tolist()), set(tag_ids)
+        for pk, (ingredients, tags) in self.delta.items():
+            count = len(ingredients & pantry)
+            if count and (not tag_ids or tags & tag_ids):
+                ids.append([pk])
+                counts.append([count])
+                sizes.append([len(ingredients)])
+        ids, counts, sizes = (
+            np.concatenate(arrays).astype(np.int64)
+            for arrays in (ids, counts, sizes))
+        coverage = counts / np.maximum(sizes, 1)
+        missing = sizes - counts
+        order = np.lexsort((-ids, missing, -coverage))
+        return PantryMatches(ids[order], coverage[order], missing[order])
+
+
+class PantryIndex:
+    """Инвертированный индекс ингредиент -> рецепты в памяти воркера
+    для подбора рецептов по имеющимся продуктам.
+
+    Индекс собирается при первом запросе. Когда меняется версия
+    рецептов или тегов, подгружаются только рецепты, изменённые после
+    прошлой синхронизации, и удалённые; основа пересобирается, когда
+    дельта превышает PANTRY_INDEX_DELTA_LIMIT рецептов или меняются
+    ингредиенты.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._state = None
+        self._versions = None
+
+    def get_state(self, request):
+        versions = get_model_versions(request, [
+            ModelVersion.objects.key_for(model)
+            for model in (Recipe, Tag, Ingredient)
+        ])
+        ingredients = ModelVersion.objects.key_for(Ingredient)
+        with self._lock:
+            state = self._state
+            if (state is None or versions.get(ingredients)
+                    != self._versions.get(ingredients)):
+                state = PantryState()
+            elif versions != self._versions:
+                state = state.updated()
+                if len(state.delta) > settings.PANTRY_INDEX_DELTA_LIMIT:
+                    state = PantryState()
+            self._state, self._versions = state, versions
+        return state
+
+
+pantry_index = PantryIndex()
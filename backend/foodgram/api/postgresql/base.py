@@ -0,0 +1,143 @@
+import gc
+import threading
+import weakref
+from functools import wraps
+
+from django.core.cache import cache
+from django.db import OperationalError, connections
+from django.db.backends.postgresql import base
+
+STATS_PREFIX = 'db_connections:stats'
+STATS_KEYS = ('opened', 'reused', 'health_check_failures', 'pool_waits',
+              'pool_timeouts')
+
+_pools = {}
+_pools_lock = threading.Lock()
+_background = threading.local()
+
+
+def count(name):
+    key = f'{STATS_PREFIX}:{name}'
+    cache.add(key, 0, timeout=None)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, 1, timeout=None)
+
+
+def connection_stats():
+    """Счётчики соединений всех воркеров, если кэш общий."""
+
+    values = cache.get_many([f'{STATS_PREFIX}:{name}' for name in STATS_KEYS])
+    return {
+        name: values.get(f'{STATS_PREFIX}:{name}', 0) for name in STATS_KEYS
+    }
+
+
+def get_pool(key, size):
+    with _pools_lock:
+        if key not in _pools:
+            _pools[key] = threading.BoundedSemaphore(size)
+        return _pools[key]
+
+
+def releasing_connections(func):
+    """Для задач фоновых потоков: соединения задачи берут слоты
+    BACKGROUND_POOL_SIZE, а не слоты потоков запросов, и по завершении
+    закрываются. Иначе при CONN_MAX_AGE > 0 простаивающий поток держал
+    бы открытое соединение и слот до конца процесса."""
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        _background.active = True
+        try:
+            return func(*args, **kwargs)
+        finally:
+            connections.close_all()
+            _background.active = False
+    return wrapper
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    """PostgreSQL с постоянными соединениями, проверкой перед запросом
+    и ограничением числа соединений в процессе.
+
+    При CONN_MAX_AGE > 0 соединение переживает запрос. Если включён
+    CONN_HEALTH_CHECKS, перед первым обращением в новом запросе оно
+    проверяется через SELECT 1 и при обрыве открывается заново, как
+    в Django 4.1. POOL_SIZE ограничивает число одновременно открытых
+    соединений потоков запросов процесса к этой базе, а
+    BACKGROUND_POOL_SIZE - соединений фоновых задач (releasing_connections),
+    чтобы очередь миниатюр или лент не оставила запросы без соединения.
+    Сверх лимита новое соединение ждёт POOL_TIMEOUT секунд. Слот
+    освобождается при закрытии соединения или когда его поток
+    завершился и обёртка соединения собрана. Это лимит, а не пул:
+    соединения не передаются между потоками.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.checked_out = False
+        self.pool_slot = None
+
+    def get_new_connection(self, conn_params):
+        self.acquire_slot()
+        try:
+            connection = super().get_new_connection(conn_params)
+        except Exception:
+            self.release_slot()
+            raise
+        count('opened')
+        return connection
+
+    def ensure_connection(self):
+        if not self.checked_out and not self.in_atomic_block:
+            self.checked_out = True
+            if self.connection is not None:
+                if (self.settings_dict.get('CONN_HEALTH_CHECKS')
+                        and not self.is_usable()):
+                    count('health_check_failures')
+                    self.close()
+                else:
+                    count('reused')
+        super().ensure_connection()
+
+    def close_if_unusable_or_obsolete(self):
+        super().close_if_unusable_or_obsolete()
+        self.checked_out = False
+
+    def _close(self):
+        try:
+            super()._close()
+        finally:
+            self.release_slot()
+
+    def acquire_slot(self):
+        kind = ('BACKGROUND_POOL_SIZE' if getattr(_background, 'active', False)
+                else 'POOL_SIZE')
+        size = self.settings_dict.get(kind)
+        if not size or self.pool_slot is not None:
+            return
+        pool = get_pool((self.alias, kind), size)
+        if not pool.acquire(blocking=False):
+            self.wait_for_slot(pool, size)
+        self.pool_slot = weakref.finalize(self, pool.release)
+
+    def wait_for_slot(self, pool, size):
+        # Обёртка соединения связана циклическими ссылками и после
+        # завершения потока (в runserver - после каждого запроса)
+        # освобождает слот только при сборке циклов.
+        gc.collect()
+        if pool.acquire(blocking=False):
+            return
+        count('pool_waits')
+        if not pool.acquire(
+                timeout=self.settings_dict.get('POOL_TIMEOUT', 10)):
+            count('pool_timeouts')
+            raise OperationalError(
+                f'Все {size} соединений с базой {self.alias} заняты.')
+
+    def release_slot(self):
+        if self.pool_slot is not None:
+            self.pool_slot()
+            self.pool_slot = None
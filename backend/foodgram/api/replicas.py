@@ -0,0 +1,119 @@
+import time
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+from rest_framework.permissions import SAFE_METHODS
+
+REPLICA_DB_ALIAS = 'replica'
+# Отставание реплики в секундах; 0, если она успела применить всё
+# полученное, и NULL, если оценить его нельзя.
+LAG_SQL = '''
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery()
+             OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn()
+        THEN 0
+        ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())
+    END
+'''
+
+use_replica = ContextVar('use_replica', default=False)
+
+
+class ReplicaMonitor:
+    """Проверяет доступность и отставание реплики не чаще раза
+    в REPLICA_CHECK_INTERVAL секунд на процесс."""
+
+    def __init__(self, alias=REPLICA_DB_ALIAS):
+        self.alias = alias
+        self._checked = None
+        self._available = False
+
+    def lag(self):
+        connection = connections[self.alias]
+        with connection.cursor() as cursor:
+            if connection.vendor != 'postgresql':
+                cursor.execute('SELECT 1')
+                return 0
+            cursor.execute(LAG_SQL)
+            return cursor.fetchone()[0]
+
+    def is_available(self):
+        now = time.monotonic()
+        if (self._checked is None
+                or now - self._checked >= settings.REPLICA_CHECK_INTERVAL):
+            try:
+                lag = self.lag()
+            except DatabaseError:
+                lag = None
+                connections[self.alias].close()
+            self._available = (
+                lag is not None and lag <= settings.REPLICA_MAX_LAG)
+            self._checked = now
+        return self._available
+
+
+replica_monitor = ReplicaMonitor()
+
+
+class ReplicaRouter:
+    """Читает с реплики, только пока ReplicaMiddleware разрешила это
+    для текущего запроса; всё остальное, включая команды и фоновые
+    задачи, идёт в основную базу. Токены всегда читаются из основной,
+    чтобы только что выданный токен сразу работал."""
+
+    primary_apps = ('authtoken',)
+
+    def db_for_read(self, model, **hints):
+        if (use_replica.get()
+                and model._meta.app_label not in self.primary_apps):
+            return REPLICA_DB_ALIAS
+        return None
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {DEFAULT_DB_ALIAS, REPLICA_DB_ALIAS}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, **hints):
+        return db != REPLICA_DB_ALIAS
+
+
+class ReplicaMiddleware:
+    """Направляет чтение безопасных запросов на реплику.
+
+    После изменяющего запроса клиент получает cookie REPLICA_PIN_COOKIE
+    на REPLICA_PIN_SECONDS секунд и до её истечения читает из основной
+    базы, видя свои изменения. Клиенты без cookie могут прислать
+    заголовок REPLICA_PIN_HEADER. Если реплика недоступна или отстаёт
+    больше REPLICA_MAX_LAG секунд, все чтения идут в основную базу.
+    """
+
+    def __init__(self, get_response):
+        if REPLICA_DB_ALIAS not in settings.DATABASES:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        safe = request.method in SAFE_METHODS
+        pinned = (settings.REPLICA_PIN_COOKIE in request.COOKIES
+                  or settings.REPLICA_PIN_HEADER in request.headers)
+        token = use_replica.set(
+            safe and not pinned and replica_monitor.is_available())
+        try:
+            response = self.get_response(request)
+        finally:
+            use_replica.reset(token)
+        if not safe:
+            response.set_cookie(
+                settings.REPLICA_PIN_COOKIE, '1',
+                max_age=settings.REPLICA_PIN_SECONDS,
+                httponly=True,
+                samesite='Lax'
+            )
+        return response
@@ -1,16 +1,20 @@
-import base64
 import re
 
+from django.conf import settings
 from django.core.exceptions import ValidationError
-from django.core.files.base import ContentFile
-from django.shortcuts import get_object_or_404
+from django.db import IntegrityError, transaction
+from django.db.models import Prefetch, prefetch_related_objects
 from django.utils.translation import gettext as _
 from djoser.serializers import UserCreateSerializer, UserSerializer
 from recipes.models import (Favorite, Ingredient, IngredientInRecipe, Recipe,
-                            ShoppingCart, Tag)
+                            ShoppingCart, ShoppingListItem, Tag)
 from rest_framework import serializers
 from users.models import Follow, User
 
+from .images import image_srcset, variant_url
+from .similar import schedule_similar
+from .uploads import UploadTooLarge, check_image, decode_base64
+
 
 class UserSerializer(UserSerializer):
     """Сериализатор для модели User проверки подписки"""
@@ -22,8 +26,10 @@ class UserSerializer(UserSerializer):
     def get_is_subscribed(self, obj):
 
         user = self.context['request'].user
-        if user.is_anonymous:
+        if user.is_anonymous or user.pk == obj.pk:
             return False
+        if hasattr(obj, 'is_subscribed'):
+            return obj.is_subscribed
         return Follow.objects.filter(user=user, author=obj).exists()
 
     class Meta:
@@ -93,7 +99,32 @@ class IngredientSerializer(serializers.ModelSerializer):
                   'measurement_unit')
 
 
-class SubscribesRecipeSerializer(serializers.ModelSerializer):
+class ImageVariantsMixin(serializers.Serializer):
+    """srcset по уменьшенным копиям фото и копия для карточки в image.
+
+    Пока копии не готовы, image и srcset отдают только оригинал.
+    """
+
+    srcset = serializers.SerializerMethodField()
+    card_image = True
+
+    def get_srcset(self, obj):
+        return image_srcset(obj, self.context.get('request'))
+
+    def use_card_image(self):
+        return self.card_image
+
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        width = settings.RECIPE_IMAGE_CARD_WIDTH
+        if self.use_card_image() and width in instance.image_variants:
+            data['image'] = variant_url(
+                instance, width, self.context.get('request'))
+        return data
+
+
+class SubscribesRecipeSerializer(ImageVariantsMixin,
+                                 serializers.ModelSerializer):
     """Сериализатор репептов подписчика"""
 
     class Meta:
@@ -101,6 +132,7 @@ class SubscribesRecipeSerializer(serializers.ModelSerializer):
         fields = ('id',
                   'name',
                   'image',
+                  'srcset',
                   'cooking_time')
 
 
@@ -131,28 +163,46 @@ class SubscribeSerializer(UserSerializer):
         request = self.context.get('request')
         recipes = obj.recipes.all()
         recipes_limit = request.query_params.get('recipes_limit')
-        if recipes_limit:
+        if recipes_limit and recipes_limit.isdigit():
             recipes = recipes[:int(recipes_limit)]
         return SubscribesRecipeSerializer(recipes, many=True).data
 
     @staticmethod
     def get_recipes_count(obj):
-        return obj.recipes.count()
+        return obj.recipes_count
 
 
 class Base64ImageField(serializers.ImageField):
+    """Изображение в виде data URL с base64 или файла multipart.
+
+    base64 декодируется частями во временный файл, multipart-файл туда
+    же пишет LimitedUploadHandler. Размер и число пикселей проверяются до
+    полного декодирования. Имя файла по содержимому задаёт хранилище.
+    """
 
     def to_internal_value(self, data):
 
         if isinstance(data, str) and data.startswith('data:image'):
-            format, imgstr = data.split(';base64,')
-            ext = format.split('/')[-1]
-            data = ContentFile(base64.b64decode(imgstr), name='photo.' + ext)
+            try:
+                data = decode_base64(data.partition(';base64,')[2])
+            except UploadTooLarge as error:
+                raise serializers.ValidationError(str(error))
+            except ValueError:
+                self.fail('invalid')
+        if hasattr(data, 'read'):
+            try:
+                extension = check_image(data)
+            except UploadTooLarge as error:
+                raise serializers.ValidationError(str(error))
+            except OSError:
+                self.fail('invalid_image')
+            data.name = f'image.{extension}'
 
         return super().to_internal_value(data)
 
 
-class AddFavoritesSerializer(serializers.ModelSerializer):
+class AddFavoritesSerializer(ImageVariantsMixin,
+                             serializers.ModelSerializer):
     image = Base64ImageField()
 
     class Meta:
@@ -160,10 +210,11 @@ class AddFavoritesSerializer(serializers.ModelSerializer):
         fields = ('id',
                   'name',
                   'image',
+                  'srcset',
                   'cooking_time')
 
 
-class RecipeSerializer(serializers.ModelSerializer):
+class RecipeSerializer(ImageVariantsMixin, serializers.ModelSerializer):
     """Сериализатор для рецептов."""
 
     tags = TagsSerializer(many=True)
@@ -183,14 +234,27 @@ class RecipeSerializer(serializers.ModelSerializer):
                   'is_in_shopping_cart',
                   'name',
                   'image',
+                  'srcset',
                   'text',
                   'cooking_time')
 
+    def use_card_image(self):
+        view = self.context.get('view')
+        return view is not None and view.action in ('list', 'feed',
+                                                    'similar', 'pantry')
+
+    def to_representation(self, instance):
+        if hasattr(instance, 'is_subscribed'):
+            instance.author.is_subscribed = instance.is_subscribed
+        return super().to_representation(instance)
+
     def get_is_favorited(self, obj):
 
         request = self.context.get('request')
         if request is None or request.user.is_anonymous:
             return False
+        if hasattr(obj, 'is_favorited'):
+            return obj.is_favorited
         return Favorite.objects.filter(
             user=request.user, recipe=obj).exists()
 
@@ -199,6 +263,8 @@ class RecipeSerializer(serializers.ModelSerializer):
         request = self.context.get('request')
         if request is None or request.user.is_anonymous:
             return False
+        if hasattr(obj, 'is_in_shopping_cart'):
+            return obj.is_in_shopping_cart
         return ShoppingCart.objects.filter(
             user=request.user, recipe=obj).exists()
 
@@ -236,11 +302,13 @@ class CreateRecipeSerializer(serializers.ModelSerializer):
     cooking_time = serializers.IntegerField()
 
     def validate_ingredients(self, value):
-        ingredients = [item['id'] for item in value]
-        for ingredient in ingredients:
-            if ingredients.count(ingredient) > 1:
-                raise serializers.ValidationError(
-                    'Не может быть одинаковых ингредиентов в рецепте!')
+        ids = [item['id'] for item in value]
+        if len(set(ids)) != len(ids):
+            raise serializers.ValidationError(
+                'Не может быть одинаковых ингредиентов в рецепте!')
+        if len(Ingredient.objects.in_bulk(ids)) != len(ids):
+            raise serializers.ValidationError(
+                'Такого ингредиента не существует!')
         return value
 
     def validate_name(self, value):
@@ -257,36 +325,82 @@ class CreateRecipeSerializer(serializers.ModelSerializer):
 
     def ingredients_in_recipe(self, recipe, ingredients):
         IngredientInRecipe.objects.bulk_create([IngredientInRecipe(
-            ingredient=get_object_or_404(Ingredient, pk=ingredient['id']),
+            ingredient_id=ingredient['id'],
             recipe=recipe,
             amount=ingredient['amount'])for ingredient in ingredients]
         )
 
+    def update_ingredients(self, recipe, ingredients):
+        """Меняет только отличающиеся строки ингредиентов рецепта.
+
+        Возвращает прежние количества {ingredient_id: amount}.
+        """
+        rows = {row.ingredient_id: row for row in recipe.ingredient_list.all()}
+        old_amounts = {pk: row.amount for pk, row in rows.items()}
+        new_amounts = {item['id']: item['amount'] for item in ingredients}
+        changed = []
+        for pk, amount in new_amounts.items():
+            if pk in rows and rows[pk].amount != amount:
+                rows[pk].amount = amount
+                changed.append(rows[pk])
+        removed = rows.keys() - new_amounts.keys()
+        if removed:
+            recipe.ingredient_list.filter(ingredient_id__in=removed).delete()
+        if changed:
+            IngredientInRecipe.objects.bulk_update(changed, ('amount',))
+        self.ingredients_in_recipe(recipe, [
+            item for item in ingredients if item['id'] not in rows])
+        return old_amounts
+
+    @transaction.atomic
     def create(self, valid_data):
         author = self.context.get('request').user
         tags = valid_data.pop('tags')
         ingredients = valid_data.pop('ingredients')
-        name = valid_data.pop('name')
-        if Recipe.objects.filter(name=name).exists():
+        try:
+            with transaction.atomic():
+                recipe = Recipe.objects.create(author=author, **valid_data)
+        except IntegrityError:
             raise serializers.ValidationError(
                 'Рецепт с таким названием уже есть!')
-        recipe = Recipe.objects.create(author=author, name=name, **valid_data)
         recipe.tags.set(tags)
         self.ingredients_in_recipe(recipe=recipe, ingredients=ingredients)
+        transaction.on_commit(lambda: schedule_similar(recipe.pk))
         return recipe
 
+    @transaction.atomic
     def update(self, instance, valid_data):
         tags = valid_data.pop('tags', None)
         ingredients = valid_data.pop('ingredients', None)
         instance = super().update(instance, valid_data)
-        instance.tags.clear()
-        instance.tags.set(tags)
-        instance.ingredients.clear()
-        self.ingredients_in_recipe(recipe=instance, ingredients=ingredients)
-        instance.save()
+        changed = False
+        if tags is not None:
+            old_tags = set(instance.tags.values_list('id', flat=True))
+            instance.tags.set(tags)
+            changed = old_tags != {tag.id for tag in tags}
+        if ingredients is not None:
+            old_amounts = self.update_ingredients(instance, ingredients)
+            new_amounts = {item['id']: item['amount'] for item in ingredients}
+            changed = changed or old_amounts.keys() != new_amounts.keys()
+            # Удалённые строки вычитает сигнал post_delete, а bulk_create
+            # и bulk_update сигналов не отправляют.
+            ShoppingListItem.objects.add_amounts(
+                instance.shopping_recipe.values_list('user_id', flat=True),
+                {pk: amount - old_amounts.get(pk, 0)
+                 for pk, amount in new_amounts.items()}
+            )
+        if changed:
+            transaction.on_commit(lambda: schedule_similar(instance.pk))
         return instance
 
     def to_representation(self, instance):
+        prefetch_related_objects(
+            [instance], 'tags', Prefetch(
+                'ingredient_list',
+                queryset=IngredientInRecipe.objects.select_related(
+                    'ingredient')
+            )
+        )
         serializer = RecipeSerializer(
             instance,
             context={'request': self.context.get('request')}
@@ -295,4 +409,5 @@ class CreateRecipeSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Recipe
-        exclude = ('created',)
+        exclude = ('created', 'updated', 'search_vector', 'image_variants',
+                   'favorites_count')
@@ -1,39 +1,123 @@
+import csv
+import io
+import threading
 from datetime import datetime
+from itertools import chain
 
-from django.db.models import Sum
-from django.http import HttpResponse
-from recipes.models import IngredientInRecipe
+from django.conf import settings
+from django.http import StreamingHttpResponse
+from recipes.models import ShoppingListItem
+from reportlab.lib.pagesizes import A4
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont
+from reportlab.pdfgen import canvas
 from rest_framework import status
 from rest_framework.response import Response
 from rest_framework.viewsets import ViewSet
 
+from .renderers import CsvRenderer, PdfRenderer, TxtRenderer
+
+PDF_FONT = 'ShoppingListFont'
+PDF_CHUNK_SIZE = 64 * 1024
+
+# Рендер PDF занимает процессор и держит документ в памяти: число
+# одновременных рендеров в процессе ограничено.
+pdf_slots = threading.BoundedSemaphore(settings.SHOPPING_LIST_PDF_CONCURRENCY)
+
+
+class Echo:
+    """Псевдо-буфер для csv.writer: возвращает строку вместо записи."""
+
+    def write(self, value):
+        return value
+
+
+def shopping_list_rows(user):
+    """Сводный список ингредиентов из корзины, читаемый курсором."""
+
+    return ShoppingListItem.objects.filter(user=user).values_list(
+        'ingredient__name',
+        'ingredient__measurement_unit',
+        'total_amount').order_by('ingredient__name').iterator()
+
+
+def txt_lines(user, rows, today):
+    yield (
+        f'Список покупок для : {user.get_full_name()}\n\n'
+        f'Дата: {today:%Y-%m-%d}\n\n'
+    )
+    for name, measurement_unit, amount in rows:
+        yield f'{name}  - {amount}({measurement_unit})\n'
+    yield f'\n Foodgram ({today:%Y})'
+
+
+def csv_lines(user, rows, today):
+    writer = csv.writer(Echo())
+    yield writer.writerow(('Ингредиент', 'Количество', 'Единица измерения'))
+    for name, measurement_unit, amount in rows:
+        yield writer.writerow((name, amount, measurement_unit))
+
+
+def render_pdf(full_name, rows, today):
+    """Рендер PDF по строкам курсора."""
+
+    if PDF_FONT not in pdfmetrics.getRegisteredFontNames():
+        pdfmetrics.registerFont(
+            TTFont(PDF_FONT, settings.SHOPPING_LIST_PDF_FONT))
+    buffer = io.BytesIO()
+    page = canvas.Canvas(buffer, pagesize=A4)
+    width, height = A4
+    page.setFont(PDF_FONT, 14)
+    page.drawString(50, height - 50, f'Список покупок для : {full_name}')
+    page.setFont(PDF_FONT, 10)
+    page.drawString(50, height - 70, f'Дата: {today:%Y-%m-%d}')
+    y = height - 100
+    for name, measurement_unit, amount in rows:
+        if y < 50:
+            page.showPage()
+            page.setFont(PDF_FONT, 10)
+            y = height - 50
+        page.drawString(50, y, f'{name}  - {amount}({measurement_unit})')
+        y -= 15
+    page.drawString(50, 30, f'Foodgram ({today:%Y})')
+    page.save()
+    return buffer.getvalue()
+
+
+def pdf_chunks(user, rows, today):
+    with pdf_slots:
+        content = render_pdf(user.get_full_name(), rows, today)
+    for start in range(0, len(content), PDF_CHUNK_SIZE):
+        yield content[start:start + PDF_CHUNK_SIZE]
+
 
 class SendTxtFileViewset(ViewSet):
     """Формирование и передача файла покупок"""
+
+    renderer_classes = (TxtRenderer, CsvRenderer, PdfRenderer)
+    generators = {
+        TxtRenderer.format: txt_lines,
+        CsvRenderer.format: csv_lines,
+        PdfRenderer.format: pdf_chunks,
+    }
+
     def list(self, request):
         user = request.user
-        if not user.shopping_user.exists():
+        rows = shopping_list_rows(user)
+        first = next(rows, None)
+        if first is None:
             return Response(
                 'Карзина пустая!',
-                status=status.HTTP_400_BAD_REQUEST
+                status=status.HTTP_400_BAD_REQUEST,
+                content_type='text/plain; charset=utf-8'
             )
-        ingredients = IngredientInRecipe.objects.filter(
-            recipe__shopping_recipe__user=request.user).values(
-            'ingredient__name',
-            'ingredient__measurement_unit').annotate(sum=Sum('amount'))
-        shopping_list = ''
-        today = datetime.today()
-        shopping_list = (
-            f'Список покупок для : {user.get_full_name()}\n\n'
-            f'Дата: {today:%Y-%m-%d}\n\n'
-        )
-        for ingredient in ingredients:
-            shopping_list += (
-                f"{ingredient['ingredient__name']}  - "
-                f"{ingredient['sum']}"
-                f"({ingredient['ingredient__measurement_unit']})\n")
-        shopping_list += f'\n Foodgram ({today:%Y})'
-        filename = f'{user.username}_shopping_list.txt'
-        response = HttpResponse(shopping_list, content_type='text/plain')
+        renderer = request.accepted_renderer
+        content = self.generators[renderer.format](
+            user, chain((first,), rows), datetime.today())
+        content_type = renderer.media_type
+        if renderer.charset:
+            content_type = f'{content_type}; charset={renderer.charset}'
+        filename = f'{user.username}_shopping_list.{renderer.extension}'
+        response = StreamingHttpResponse(content, content_type=content_type)
         response['Content-Disposition'] = f'attachment; filename={filename}'
         return response
@@ -0,0 +1,226 @@
+from django.conf import settings
+from django.db import transaction
+from django.db.backends.signals import connection_created
+from django.db.models import F
+from django.db.models.signals import (post_delete, post_save, pre_delete,
+                                      pre_save)
+from django.dispatch import receiver
+from recipes.models import (Favorite, FeedEntry, Ingredient,
+                            IngredientInRecipe, ModelVersion, Recipe,
+                            ShoppingCart, ShoppingListItem, StoredFile, Tag)
+from rest_framework.authtoken.models import Token
+from users.models import Follow, User
+
+from .authentication import forget_tokens
+from .feed import schedule_fan_out
+from .images import schedule_variants
+from .ingredient_index import ingredient_index
+
+
+@receiver((post_save, post_delete), sender=Ingredient)
+def invalidate_ingredient_index(**kwargs):
+    transaction.on_commit(ingredient_index.invalidate)
+
+
+@receiver(connection_created)
+def set_trigram_threshold(connection, **kwargs):
+    if connection.vendor != 'postgresql':
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SET pg_trgm.word_similarity_threshold = %s',
+            (settings.INGREDIENT_SEARCH_SIMILARITY,)
+        )
+
+
+# Поля пользователя, которые видны в ответах с рецептами.
+AUTHOR_FIELDS = ('email', 'username', 'first_name', 'last_name')
+
+
+@receiver((post_save, post_delete), sender=Tag)
+@receiver((post_save, post_delete), sender=Ingredient)
+@receiver((post_save, post_delete), sender=Recipe)
+@receiver(post_delete, sender=User)
+def bump_model_version(sender, **kwargs):
+    ModelVersion.objects.bump(ModelVersion.objects.key_for(sender))
+
+
+@receiver(pre_save, sender=User)
+def remember_author_fields(instance, update_fields, **kwargs):
+    instance._stored_author = None
+    if instance.pk and (update_fields is None
+                        or not set(update_fields).isdisjoint(AUTHOR_FIELDS)):
+        instance._stored_author = User.objects.filter(
+            pk=instance.pk).values_list(*AUTHOR_FIELDS).first()
+
+
+@receiver(post_save, sender=User)
+def bump_author_version(instance, created, **kwargs):
+    """Версия пользователей меняется только вместе с полями автора:
+    вход (last_login), пароль и счётчики не сбрасывают ETag рецептов."""
+
+    stored = getattr(instance, '_stored_author', None)
+    if not created and (
+            stored is None
+            or stored == tuple(getattr(instance, field)
+                               for field in AUTHOR_FIELDS)):
+        return
+    ModelVersion.objects.bump(ModelVersion.objects.key_for(User))
+
+
+@receiver((post_save, post_delete), sender=Favorite)
+@receiver((post_save, post_delete), sender=ShoppingCart)
+@receiver((post_save, post_delete), sender=Follow)
+def bump_user_version(sender, instance, **kwargs):
+    ModelVersion.objects.bump(
+        ModelVersion.objects.key_for(sender, instance.user_id))
+
+
+@receiver(pre_save, sender=Recipe)
+def remember_recipe_image(instance, **kwargs):
+    instance._stored_image = instance.pk and Recipe.objects.filter(
+        pk=instance.pk).values_list('image', flat=True).first()
+
+
+@receiver(post_save, sender=Recipe)
+def count_recipe_image(instance, **kwargs):
+    previous = getattr(instance, '_stored_image', None)
+    if previous != instance.image.name:
+        StoredFile.objects.change_references(instance.image.name, 1)
+        StoredFile.objects.change_references(previous, -1)
+
+
+@receiver(post_save, sender=Recipe)
+def refresh_image_variants(instance, created, **kwargs):
+    """Копии прежнего фото сбрасываются при любой смене фото рецепта,
+    в том числе из админки, а для нового ставятся в очередь."""
+
+    if not created and (
+            getattr(instance, '_stored_image', None) == instance.image.name):
+        return
+    if instance.image_variants:
+        instance.image_variants = []
+        Recipe.objects.filter(pk=instance.pk).update(image_variants=[])
+    transaction.on_commit(lambda: schedule_variants(instance))
+
+
+@receiver(pre_delete, sender=Recipe)
+def lock_deleted_recipe(instance, **kwargs):
+    """Удаляемый рецепт блокируется до удаления связанных строк: иначе
+    refresh_similar мог бы успеть сослаться на него из SimilarRecipe."""
+
+    list(Recipe.objects.select_for_update().filter(
+        pk=instance.pk).values_list('pk'))
+
+
+@receiver(post_delete, sender=Recipe)
+def release_recipe_image(instance, **kwargs):
+    StoredFile.objects.change_references(instance.image.name, -1)
+
+
+COUNTERS = {
+    Favorite: (Recipe, 'recipe_id', 'favorites_count'),
+    Follow: (User, 'author_id', 'followers_count'),
+    Recipe: (User, 'author_id', 'recipes_count'),
+}
+
+
+def change_counter(sender, instance, delta):
+    model, key, field = COUNTERS[sender]
+    objects = model.objects.filter(pk=getattr(instance, key))
+    if delta < 0:
+        objects = objects.filter(**{f'{field}__gte': -delta})
+    objects.update(**{field: F(field) + delta})
+
+
+@receiver(post_save, sender=Favorite)
+@receiver(post_save, sender=Follow)
+@receiver(post_save, sender=Recipe)
+def increment_counter(sender, instance, created, **kwargs):
+    if created:
+        change_counter(sender, instance, 1)
+
+
+@receiver(post_delete, sender=Favorite)
+@receiver(post_delete, sender=Follow)
+@receiver(post_delete, sender=Recipe)
+def decrement_counter(sender, instance, **kwargs):
+    change_counter(sender, instance, -1)
+
+
+# Сводный список покупок - сумма по парам (корзина, строка ингредиента
+# рецепта). Пара вычитается, когда удаляется первая из двух строк: при
+# каскадном удалении рецепта вторая уже не находит первую, в каком бы
+# порядке их ни удалял Django.
+@receiver(post_save, sender=ShoppingCart)
+def add_to_shopping_list(instance, created, **kwargs):
+    if created:
+        ShoppingListItem.objects.add_recipe(
+            (instance.user_id,), instance.recipe_id)
+
+
+@receiver(post_delete, sender=ShoppingCart)
+def remove_from_shopping_list(instance, **kwargs):
+    ShoppingListItem.objects.add_recipe(
+        (instance.user_id,), instance.recipe_id, sign=-1)
+
+
+def change_shopping_amount(recipe_id, ingredient_id, amount):
+    ShoppingListItem.objects.add_amounts(
+        ShoppingCart.objects.filter(
+            recipe_id=recipe_id).values_list('user_id', flat=True),
+        {ingredient_id: amount}
+    )
+
+
+@receiver(pre_save, sender=IngredientInRecipe)
+def remember_ingredient_amount(instance, **kwargs):
+    instance._stored_amount = instance.pk and (
+        IngredientInRecipe.objects.filter(pk=instance.pk).values_list(
+            'recipe_id', 'ingredient_id', 'amount').first())
+
+
+@receiver(post_save, sender=IngredientInRecipe)
+def update_shopping_amount(instance, **kwargs):
+    previous = getattr(instance, '_stored_amount', None)
+    current = (instance.recipe_id, instance.ingredient_id, instance.amount)
+    if previous and previous[:2] == current[:2]:
+        change_shopping_amount(*current[:2], current[2] - previous[2])
+        return
+    if previous:
+        change_shopping_amount(*previous[:2], -previous[2])
+    change_shopping_amount(*current)
+
+
+@receiver(post_delete, sender=IngredientInRecipe)
+def subtract_shopping_amount(instance, **kwargs):
+    change_shopping_amount(
+        instance.recipe_id, instance.ingredient_id, -instance.amount)
+
+
+@receiver(post_delete, sender=Token)
+def forget_deleted_token(instance, **kwargs):
+    forget_tokens(instance.key)
+
+
+@receiver((post_save, post_delete), sender=User)
+def forget_user_tokens(instance, **kwargs):
+    forget_tokens(*Token.objects.filter(
+        user_id=instance.pk).values_list('key', flat=True))
+
+
+@receiver(post_save, sender=Recipe)
+def fan_out_recipe(instance, created, **kwargs):
+    if created:
+        transaction.on_commit(lambda: schedule_fan_out(instance))
+
+
+@receiver(post_save, sender=Follow)
+def backfill_feed(instance, created, **kwargs):
+    if created:
+        FeedEntry.objects.backfill(instance.user_id, instance.author_id)
+
+
+@receiver(post_delete, sender=Follow)
+def prune_feed(instance, **kwargs):
+    FeedEntry.objects.prune(instance.user_id, instance.author_id)
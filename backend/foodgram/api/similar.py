@@ -0,0 +1,268 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, OuterRef, Q, Subquery
+from recipes.models import (IngredientInRecipe, ModelVersion, Recipe,
+                            SimilarRecipe)
+from scipy import sparse
+
+from .background import submit
+from .postgresql.base import releasing_connections
+
+RecipeTag = Recipe.tags.through
+
+similar_executor = ThreadPoolExecutor(
+    max_workers=1,
+    thread_name_prefix='similar_recipes'
+)
+
+
+def similarity(overlap, sizes, other_sizes, tag_overlap, tag_sizes,
+               other_tag_sizes):
+    """Косинус бинарных векторов ингредиентов плюс
+    SIMILAR_RECIPES_TAG_WEIGHT * коэффициент Жаккара по тегам."""
+
+    cosine = overlap / np.sqrt(sizes * other_sizes)
+    tag_union = tag_sizes + other_tag_sizes - tag_overlap
+    jaccard = np.divide(
+        tag_overlap, tag_union,
+        out=np.zeros(len(tag_union)), where=tag_union > 0)
+    return cosine + settings.SIMILAR_RECIPES_TAG_WEIGHT * jaccard
+
+
+def top_k(ids, scores):
+    """SIMILAR_RECIPES_COUNT лучших [(id, сходство)] по убыванию,
+    при равном сходстве - по возрастанию id."""
+
+    count = settings.SIMILAR_RECIPES_COUNT
+    if len(scores) > count:
+        # Все рецепты со сходством не ниже count-го: argpartition выбрал
+        # бы из равных произвольные.
+        threshold = -np.partition(-scores, count - 1)[count - 1]
+        best = scores >= threshold
+        ids, scores = ids[best], scores[best]
+    order = np.lexsort((ids, -scores))[:count]
+    return list(zip(ids[order].tolist(), scores[order].tolist()))
+
+
+def incidence(pairs, row_ids):
+    """Разреженная матрица (строки row_ids) x (столбцы по второму
+    элементу пар) из пар (id строки, id столбца)."""
+
+    pairs = np.array(pairs, dtype=np.int64).reshape(-1, 2)
+    pairs = pairs[np.isin(pairs[:, 0], row_ids)]
+    columns = np.unique(pairs[:, 1], return_inverse=True)[1]
+    matrix = sparse.csr_matrix(
+        (np.ones(len(pairs), dtype=np.int32),
+         (np.searchsorted(row_ids, pairs[:, 0]), columns)),
+        shape=(len(row_ids), columns.max(initial=-1) + 1)
+    )
+    matrix.data[:] = 1
+    return matrix
+
+
+def build_similar():
+    """Соседи всех рецептов: итератор пар (recipe_id, [(id, сходство)]).
+
+    Строится CSR-матрица рецепт x ингредиент. Кандидаты - рецепты
+    с общим ингредиентом, который встречается не более чем в
+    SIMILAR_RECIPES_COMMON_SHARE рецептов: иначе соль и вода сделали бы
+    произведение матриц плотным. Частые ингредиенты и теги хранятся
+    плотными битовыми столбцами и досчитываются к найденным парам.
+    Рецепт, у которого по редким ингредиентам кандидатов нет,
+    сравнивается со всеми рецептами с общим частым ингредиентом, а в
+    каталоге меньше SIMILAR_RECIPES_MIN_CATALOGUE рецептов частых
+    ингредиентов нет вовсе. Данные читаются из базы сразу, а
+    произведение считается при обходе блоками по SIMILAR_RECIPES_BLOCK
+    строк.
+    """
+    pairs = list(IngredientInRecipe.objects.values_list(
+        'recipe_id', 'ingredient_id').iterator())
+    recipe_ids = np.unique(
+        np.array([recipe_id for recipe_id, _ in pairs], dtype=np.int64))
+    if not len(recipe_ids):
+        return iter(())
+    matrix = incidence(pairs, recipe_ids)
+    sizes = np.diff(matrix.indptr)
+    frequency = np.bincount(matrix.indices, minlength=matrix.shape[1])
+    common = (frequency
+              > settings.SIMILAR_RECIPES_COMMON_SHARE * len(recipe_ids))
+    if len(recipe_ids) < settings.SIMILAR_RECIPES_MIN_CATALOGUE:
+        common[:] = False
+    rare = matrix[:, ~common].tocsr()
+    rare_transposed = rare.T.tocsr()
+    common = matrix[:, common].toarray().astype(bool)
+    tags = incidence(
+        list(RecipeTag.objects.values_list('recipe_id', 'tag_id')),
+        recipe_ids
+    ).toarray().astype(bool)
+    tag_sizes = tags.sum(axis=1)
+
+    def common_neighbours(row):
+        overlap = (common[row] & common).sum(axis=1)
+        overlap[row] = 0
+        others = np.flatnonzero(overlap)
+        return top_k(recipe_ids[others], similarity(
+            overlap[others], sizes[row], sizes[others],
+            (tags[row] & tags[others]).sum(axis=1),
+            tag_sizes[row], tag_sizes[others]
+        ))
+
+    def neighbours():
+        for start in range(
+                0, len(recipe_ids), settings.SIMILAR_RECIPES_BLOCK):
+            stop = min(
+                start + settings.SIMILAR_RECIPES_BLOCK, len(recipe_ids))
+            product = (rare[start:stop] @ rare_transposed).tocsr()
+            rows = np.repeat(np.arange(start, stop), np.diff(product.indptr))
+            columns = product.indices
+            scores = similarity(
+                product.data + (common[rows] & common[columns]).sum(axis=1),
+                sizes[rows], sizes[columns],
+                (tags[rows] & tags[columns]).sum(axis=1),
+                tag_sizes[rows], tag_sizes[columns]
+            )
+            for row in range(stop - start):
+                begin, end = product.indptr[row], product.indptr[row + 1]
+                others = columns[begin:end]
+                own = others != start + row
+                if not own.any():
+                    yield (int(recipe_ids[start + row]),
+                           common_neighbours(start + row))
+                    continue
+                yield int(recipe_ids[start + row]), top_k(
+                    recipe_ids[others[own]], scores[begin:end][own])
+
+    return neighbours()
+
+
+def candidate_rows(sharing, tags):
+    """Строки (id, общих ингредиентов, ингредиентов, общих тегов,
+    тегов) для кандидатов из sharing."""
+
+    return list(sharing.annotate(
+        size=Subquery(
+            IngredientInRecipe.objects.filter(
+                recipe_id=OuterRef('recipe_id')
+            ).order_by().values('recipe_id').annotate(
+                total=Count('id')).values('total')
+        ),
+        tag_overlap=Subquery(
+            RecipeTag.objects.filter(
+                recipe_id=OuterRef('recipe_id'), tag_id__in=tags
+            ).order_by().values('recipe_id').annotate(
+                total=Count('id')).values('total')
+        ),
+        tag_size=Subquery(
+            RecipeTag.objects.filter(
+                recipe_id=OuterRef('recipe_id')
+            ).order_by().values('recipe_id').annotate(
+                total=Count('id')).values('total')
+        ),
+    ).values_list('recipe_id', 'overlap', 'size', 'tag_overlap', 'tag_size'))
+
+
+def recipe_neighbours(recipe_id):
+    """Сходство рецепта со всеми кандидатами {id: сходство} запросом
+    к базе, по тем же правилам, что и build_similar."""
+
+    ingredients = list(IngredientInRecipe.objects.filter(
+        recipe_id=recipe_id).values_list('ingredient_id', flat=True))
+    if not ingredients:
+        return {}
+    catalogue = IngredientInRecipe.objects.values(
+        'recipe_id').distinct().count()
+    limit = settings.SIMILAR_RECIPES_COMMON_SHARE * catalogue
+    rare = [
+        pk for pk, frequency in IngredientInRecipe.objects.filter(
+            ingredient_id__in=ingredients
+        ).order_by().values('ingredient_id').annotate(
+            frequency=Count('id')).values_list('ingredient_id', 'frequency')
+        if frequency <= limit
+        or catalogue < settings.SIMILAR_RECIPES_MIN_CATALOGUE
+    ]
+    tags = list(RecipeTag.objects.filter(
+        recipe_id=recipe_id).values_list('tag_id', flat=True))
+    sharing = IngredientInRecipe.objects.filter(
+        ingredient_id__in=ingredients
+    ).exclude(recipe_id=recipe_id).order_by().values('recipe_id').annotate(
+        overlap=Count('id'))
+    candidates = []
+    if rare:
+        candidates = candidate_rows(sharing.annotate(
+            rare=Count('id', filter=Q(ingredient_id__in=rare))
+        ).filter(rare__gt=0), tags)
+    if not candidates:
+        candidates = candidate_rows(sharing, tags)
+    if not candidates:
+        return {}
+    ids, overlap, sizes, tag_overlap, tag_sizes = (
+        np.array(column, dtype=np.float64)
+        for column in zip(*((value or 0 for value in row)
+                            for row in candidates))
+    )
+    scores = similarity(
+        overlap, len(ingredients), sizes, tag_overlap, len(tags), tag_sizes)
+    return dict(zip(ids.astype(np.int64).tolist(), scores.tolist()))
+
+
+@transaction.atomic
+def refresh_similar(recipe_id):
+    """Пересчитывает соседей рецепта и его место в чужих списках.
+
+    Чужие списки обновляются приближённо: сходство с рецептом
+    пересчитывается или удаляется, а рецепт добавляется к своим новым
+    соседям, если проходит в их top-k. Точный пересчёт делает
+    build_similar_recipes.
+    """
+    scores = recipe_neighbours(recipe_id)
+    # Рецепты, на которые сошлются строки, блокируются до конца
+    # транзакции: удаление рецепта (lock_deleted_recipe) дождётся её и
+    # удалит эти строки, а уже удалённые рецепты отбрасываются.
+    existing = set(Recipe.objects.select_for_update(no_key=True).filter(
+        pk__in=[recipe_id, *scores]).order_by('pk').values_list(
+            'pk', flat=True))
+    if recipe_id not in existing:
+        return
+    scores = {pk: score for pk, score in scores.items() if pk in existing}
+    neighbours = top_k(
+        np.array(list(scores), dtype=np.int64),
+        np.array(list(scores.values()), dtype=np.float64))
+    SimilarRecipe.objects.filter(recipe_id=recipe_id).delete()
+    SimilarRecipe.objects.bulk_create(
+        SimilarRecipe(recipe_id=recipe_id, similar_id=pk, score=score)
+        for pk, score in neighbours
+    )
+    stale = SimilarRecipe.objects.filter(similar_id=recipe_id)
+    stale.exclude(recipe_id__in=list(scores)).delete()
+    updated = list(stale)
+    for row in updated:
+        row.score = scores[row.recipe_id]
+    SimilarRecipe.objects.bulk_update(updated, ('score',))
+    listed = {row.recipe_id for row in updated}
+    lists = {}
+    for row in SimilarRecipe.objects.filter(
+            recipe_id__in=[pk for pk, _ in neighbours if pk not in listed]):
+        lists.setdefault(row.recipe_id, []).append(row)
+    for pk, score in neighbours:
+        if pk in listed:
+            continue
+        rows = lists.get(pk, [])
+        if len(rows) >= settings.SIMILAR_RECIPES_COUNT:
+            worst = min(rows, key=lambda row: row.score)
+            if worst.score >= score:
+                continue
+            worst.delete()
+        SimilarRecipe.objects.bulk_create(
+            [SimilarRecipe(recipe_id=pk, similar_id=recipe_id, score=score)],
+            ignore_conflicts=True)
+    ModelVersion.objects.bump(ModelVersion.objects.key_for(Recipe))
+
+
+def schedule_similar(recipe_id):
+    """Ставит в очередь обновление соседей рецепта."""
+
+    submit(
+        similar_executor, releasing_connections(refresh_similar), recipe_id)
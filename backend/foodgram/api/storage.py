@@ -0,0 +1,69 @@
+import os
+import uuid
+from hashlib import sha256
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage
+from django.db import transaction
+from recipes.models import StoredFile
+
+
+class DerivedFile(ContentFile):
+    """Файл, производный от сохранённого (уменьшенная копия фото).
+
+    Сохраняется под заданным именем, а не по хэшу содержимого: имя
+    копии выводится из имени оригинала, а у старых фото это имя - не хэш.
+    """
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """Хранилище, в котором имя файла - SHA-256 его содержимого.
+
+    Одинаковые файлы хранятся один раз, а содержимое по имени никогда
+    не меняется, поэтому такие имена в /media/ кэшируются как immutable.
+    Производные файлы (DerivedFile) сохраняются под своими именами и
+    заменяют прежнее содержимое. Ссылки на файлы считает StoredFile,
+    удаляет лишние collect_media.
+
+    Проверка, есть ли уже такой файл, делается под блокировкой его
+    записи StoredFile: collect_media удаляет файлы под той же
+    блокировкой и не сотрёт файл, который сохранение сочло существующим.
+    """
+
+    def get_available_name(self, name, max_length=None):
+        return name
+
+    def _save(self, name, content):
+        if isinstance(content, DerivedFile):
+            return self._replace(name, content)
+        directory, basename = os.path.split(name)
+        digest = sha256()
+        for chunk in content.chunks():
+            digest.update(chunk)
+        name = os.path.join(
+            directory,
+            digest.hexdigest() + os.path.splitext(basename)[1].lower())
+        with transaction.atomic():
+            # Блокировка держится до конца внешней транзакции, в которой
+            # сигнал count_recipe_image добавит ссылку на файл, а вне её
+            # collect_media не тронет запись со свежей датой изменения.
+            stored, created = StoredFile.objects.select_for_update(
+            ).get_or_create(name=name)
+            if not created:
+                stored.save(update_fields=('updated',))
+            if not self.exists(name):
+                self._replace(name, content)
+        return name
+
+    def _replace(self, name, content):
+        directory, basename = os.path.split(name)
+        extension = os.path.splitext(basename)[1]
+        temporary = super()._save(
+            os.path.join(directory, f'.{uuid.uuid4().hex}{extension}'),
+            content)
+        if hasattr(content, 'temporary_file_path'):
+            # Временный файл загрузки перемещён, а не скопирован: закрытый
+            # сейчас, он не попытается удалить себя при сборке мусора.
+            content.close()
+        os.replace(self.path(temporary), self.path(name))
+        return name
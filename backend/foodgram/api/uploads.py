@@ -0,0 +1,80 @@
+import base64
+import binascii
+
+from django.conf import settings
+from django.core.files.uploadedfile import TemporaryUploadedFile
+from django.core.files.uploadhandler import TemporaryFileUploadHandler
+from django.http.multipartparser import MultiPartParserError
+from PIL import Image
+
+BASE64_CHUNK = 4 * 64 * 1024
+EXTENSIONS = {'jpeg': 'jpg'}
+
+
+class UploadTooLarge(Exception):
+    pass
+
+
+def size_error():
+    return f'Размер файла больше {settings.UPLOAD_MAX_SIZE} байт.'
+
+
+def pixels_error():
+    return f'Изображение больше {settings.UPLOAD_MAX_PIXELS} пикселей.'
+
+
+class LimitedUploadHandler(TemporaryFileUploadHandler):
+    """Пишет загружаемые файлы во временный файл по частям и прерывает
+    разбор запроса, как только файл превышает UPLOAD_MAX_SIZE."""
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.size = 0
+
+    def receive_data_chunk(self, raw_data, start):
+        self.size += len(raw_data)
+        if self.size > settings.UPLOAD_MAX_SIZE:
+            self.file.close()
+            raise MultiPartParserError(size_error())
+        return super().receive_data_chunk(raw_data, start)
+
+
+def decode_base64(data):
+    """Декодирует base64 во временный файл частями, не держа в памяти
+    всё содержимое в декодированном виде.
+
+    Как и у multipart-загрузки, у файла есть temporary_file_path():
+    по нему ImageField проверяет изображение, не читая файл в память.
+    """
+    if len(data) // 4 * 3 > settings.UPLOAD_MAX_SIZE:
+        raise UploadTooLarge(size_error())
+    file = TemporaryUploadedFile('upload', 'application/octet-stream', 0, None)
+    for start in range(0, len(data), BASE64_CHUNK):
+        try:
+            file.write(base64.b64decode(
+                data[start:start + BASE64_CHUNK], validate=True))
+        except (binascii.Error, ValueError):
+            file.close()
+            raise
+    file.size = file.tell()
+    file.seek(0)
+    return file
+
+
+def check_image(file):
+    """Проверяет размеры по заголовку, не декодируя пиксели.
+
+    Возвращает расширение по фактическому формату изображения.
+    """
+    position = file.tell()
+    try:
+        with Image.open(file) as image:
+            width, height = image.size
+            image_format = (image.format or '').lower()
+    except Image.DecompressionBombError:
+        raise UploadTooLarge(pixels_error())
+    finally:
+        file.seek(position)
+    if width * height > settings.UPLOAD_MAX_PIXELS:
+        raise UploadTooLarge(pixels_error())
+    return EXTENSIONS.get(image_format, image_format)
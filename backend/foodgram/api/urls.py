@@ -2,8 +2,8 @@ from django.urls import include, path
 from rest_framework import routers
 
 from .services import SendTxtFileViewset
-from .views import (CustomUserViewSet, IngredientViewSet, RecipeViewSet,
-                    TagViewSet)
+from .views import (CacheStatsView, CustomUserViewSet, DatabaseStatsView,
+                    IngredientViewSet, RecipeViewSet, TagViewSet)
 
 router = routers.DefaultRouter()
 router.register('tags', TagViewSet, basename='tags')
@@ -19,6 +19,8 @@ app_name = 'api'
 
 
 urlpatterns = [
+    path('cache/stats/', CacheStatsView.as_view(), name='cache_stats'),
+    path('db/stats/', DatabaseStatsView.as_view(), name='db_stats'),
     path('', include(router.urls)),
     path('', include('djoser.urls')),
     path('auth/', include('djoser.urls.authtoken')),
@@ -1,31 +1,63 @@
+from django.db import transaction
+from django.db.models import (Count, Exists, F, Max, OuterRef, Prefetch, Value,
+                              Window, prefetch_related_objects)
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import RowNumber
+from django.http import Http404
 from django.shortcuts import get_object_or_404
 from django_filters.rest_framework import DjangoFilterBackend
 from djoser.views import UserViewSet
-from recipes.models import Favorite, Ingredient, Recipe, ShoppingCart, Tag
+from recipes.models import (Favorite, Ingredient, IngredientInRecipe, Recipe,
+                            ShoppingCart, Tag)
 from rest_framework import status, viewsets
 from rest_framework.decorators import action
-from rest_framework.pagination import LimitOffsetPagination
-from rest_framework.permissions import (SAFE_METHODS, AllowAny,
+from rest_framework.exceptions import ValidationError
+from rest_framework.permissions import (SAFE_METHODS, AllowAny, IsAdminUser,
                                         IsAuthenticated,
                                         IsAuthenticatedOrReadOnly)
 from rest_framework.response import Response
+from rest_framework.views import APIView
 from rest_framework.viewsets import ModelViewSet
 from users.models import Follow, User
 
+from .cache import response_cache
+from .catalogue import ingredient_catalogue
 from .filters import IngredientFilter, RecipeFilter
-from .mixins import ListRetriveViewSet
-from .paginations import CustomPagination
+from .ingredient_index import ingredient_index
+from .mixins import (CachedResponseMixin, ConditionalGetMixin,
+                     ListRetriveViewSet)
+from .paginations import (CustomPagination, FeedPagination, PantryPagination,
+                          UserPagination)
+from .pantry import pantry_index
 from .permissions import IsAuthorOrReadOnly
+from .postgresql.base import connection_stats
 from .serializers import (AddFavoritesSerializer, CreateRecipeSerializer,
                           IngredientSerializer, RecipeSerializer,
                           SubscribeSerializer, TagsSerializer)
 
 
+def limited_recipes(authors, limit):
+    """Не более limit последних рецептов каждого автора одним запросом."""
+
+    ranked = Recipe.objects.filter(author__in=authors).annotate(
+        row_number=Window(
+            expression=RowNumber(),
+            partition_by=F('author'),
+            order_by=F('created').desc()
+        )
+    ).order_by().values('id', 'row_number')
+    sql, params = ranked.query.sql_with_params()
+    return Recipe.objects.filter(pk__in=RawSQL(
+        f'SELECT id FROM ({sql}) AS ranked WHERE row_number <= %s',
+        (*params, limit)
+    ))
+
+
 class CustomUserViewSet(UserViewSet):
 
     queryset = User.objects.all()
     permission_classes = (IsAuthenticatedOrReadOnly,)
-    pagination_class = LimitOffsetPagination
+    pagination_class = UserPagination
 
     @action(
         detail=False,
@@ -34,15 +66,23 @@ class CustomUserViewSet(UserViewSet):
         url_path='subscriptions',
     )
     def subscriptions(self, request):
-        queryset = User.objects.filter(follow__user=request.user)
-        if queryset:
-            pages = self.paginate_queryset(queryset)
-            serializer = SubscribeSerializer(
-                pages, many=True, context={'request': request})
-            return self.get_paginated_response(serializer.data)
-        return Response(
-            {'Внимание!': 'У вас нет подписок!'},
-            status=status.HTTP_400_BAD_REQUEST)
+        authors = User.objects.filter(follow__user=request.user)
+        if not authors.exists():
+            return Response(
+                {'Внимание!': 'У вас нет подписок!'},
+                status=status.HTTP_400_BAD_REQUEST)
+        pages = self.paginate_queryset(
+            authors.annotate(is_subscribed=Value(True)))
+        recipes = Recipe.objects.all()
+        recipes_limit = request.query_params.get('recipes_limit')
+        if recipes_limit and recipes_limit.isdigit():
+            recipes = limited_recipes(
+                [author.id for author in pages], int(recipes_limit))
+        prefetch_related_objects(
+            pages, Prefetch('recipes', queryset=recipes))
+        serializer = SubscribeSerializer(
+            pages, many=True, context={'request': request})
+        return self.get_paginated_response(serializer.data)
 
     @action(
         detail=True,
@@ -82,19 +122,23 @@ class CustomUserViewSet(UserViewSet):
             )
 
 
-class TagViewSet(ListRetriveViewSet):
+class TagViewSet(ConditionalGetMixin, CachedResponseMixin,
+                 ListRetriveViewSet):
     """Вьюсет Тегов"""
     queryset = Tag.objects.all()
+    version_models = (Tag,)
     serializer_class = TagsSerializer
     pagination_class = None
     permission_classes = (AllowAny,)
     http_method_names = ('get',)
 
 
-class IngredientViewSet(viewsets.ReadOnlyModelViewSet):
+class IngredientViewSet(ConditionalGetMixin, CachedResponseMixin,
+                        viewsets.ReadOnlyModelViewSet):
     """Вьюсет ингредиентов"""
 
     queryset = Ingredient.objects.all()
+    version_models = (Ingredient,)
     serializer_class = IngredientSerializer
     permission_classes = (AllowAny,)
     pagination_class = None
@@ -102,21 +146,157 @@ class IngredientViewSet(viewsets.ReadOnlyModelViewSet):
     filterset_class = IngredientFilter
     http_method_names = ('get',)
 
+    def list(self, request, *args, **kwargs):
+        if (not request.query_params
+                and request.accepted_renderer.format == 'json'):
+            return ingredient_catalogue.response(request)
+        if request.query_params.get('name') is None:
+            return super().list(request, *args, **kwargs)
+        return self.conditional_response(
+            self.list_from_index, request, *args, **kwargs)
+
+    def list_from_index(self, request, *args, **kwargs):
+        return Response(ingredient_index.search(request.query_params['name']))
+
 
-class RecipeViewSet(ModelViewSet):
+class RecipeViewSet(ConditionalGetMixin, CachedResponseMixin, ModelViewSet):
     """Управление рецептами"""
 
-    queryset = Recipe.objects.all()
     pagination_class = CustomPagination
     permission_classes = (IsAuthorOrReadOnly,)
     filter_backends = (DjangoFilterBackend,)
     filterset_class = RecipeFilter
+    version_models = (Recipe, Tag, Ingredient, User)
+    user_version_models = (Favorite, ShoppingCart, Follow)
+    cache_anonymous_only = True
+
+    def get_extra_validators(self):
+        """Для рецепта - его наличие и дата изменения.
+
+        Список валидируется только счётчиками ModelVersion: версия
+        рецептов меняется при каждом сохранении и удалении, а агрегат
+        по всей отфильтрованной выборке вернул бы COUNT(*), которого
+        избегает keyset-пагинация.
+        """
+        if self.action != 'retrieve':
+            return super().get_extra_validators()
+        try:
+            queryset = Recipe.objects.filter(pk=self.kwargs['pk'])
+        except (TypeError, ValueError):
+            raise Http404
+        aggregate = queryset.aggregate(
+            updated=Max('updated'), count=Count('id'))
+        return (aggregate['count'],), aggregate['updated']
+
+    def get_queryset(self):
+        """Рецепты с отметками пользователя и связями за фиксированное
+        число запросов, независимо от размера страницы."""
+
+        queryset = Recipe.objects.select_related('author').prefetch_related(
+            Prefetch('tags', queryset=Tag.objects.all()),
+            Prefetch(
+                'ingredient_list',
+                queryset=IngredientInRecipe.objects.select_related(
+                    'ingredient')
+            )
+        )
+        user = self.request.user
+        if user.is_anonymous:
+            return queryset
+        return queryset.annotate(
+            is_favorited=Exists(Favorite.objects.filter(
+                user=user, recipe=OuterRef('pk'))),
+            is_in_shopping_cart=Exists(ShoppingCart.objects.filter(
+                user=user, recipe=OuterRef('pk'))),
+            is_subscribed=Exists(Follow.objects.filter(
+                user=user, author=OuterRef('author')))
+        )
 
     def get_serializer_class(self):
         if self.request.method in SAFE_METHODS:
             return RecipeSerializer
         return CreateRecipeSerializer
 
+    @action(
+        detail=False,
+        methods=('get',),
+        permission_classes=(IsAuthenticated,),
+        pagination_class=FeedPagination,
+        url_path='feed',
+        url_name='feed',
+    )
+    def feed(self, request):
+        """Новые рецепты авторов из подписок по ленте пользователя"""
+
+        queryset = self.get_queryset().filter(
+            feed_entries__user=request.user
+        ).annotate(feed_created=F('feed_entries__created'))
+        page = self.paginate_queryset(queryset)
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
+
+    @action(
+        detail=False,
+        methods=('get',),
+        pagination_class=PantryPagination,
+        url_path='pantry',
+        url_name='pantry',
+    )
+    def pantry(self, request):
+        """Рецепты по доле ингредиентов, которые есть у пользователя"""
+
+        try:
+            ingredients = [
+                int(pk) for pk
+                in request.query_params.get('ingredients', '').split(',')
+                if pk.strip()
+            ]
+        except ValueError:
+            ingredients = None
+        if not ingredients:
+            raise ValidationError({'ingredients': [
+                'Укажите id ингредиентов через запятую.']})
+        state = pantry_index.get_state(request)
+        try:
+            tag_ids = [state.slugs[slug]
+                       for slug in request.query_params.getlist('tags')]
+        except KeyError as error:
+            raise ValidationError({'tags': [f'Нет тега {error}.']})
+        matches = state.search(ingredients, tag_ids)
+        page = self.paginate_queryset(range(len(matches.ids)))
+        recipes = self.get_queryset().in_bulk(
+            matches.ids[page].tolist())
+        found = [index for index in page
+                 if matches.ids[index] in recipes]
+        serializer = self.get_serializer(
+            [recipes[matches.ids[index]] for index in found], many=True)
+        return self.get_paginated_response([
+            {**data,
+             'coverage': round(float(matches.coverage[index]), 3),
+             'missing': int(matches.missing[index])}
+            for index, data in zip(found, serializer.data)
+        ])
+
+    @action(
+        detail=True,
+        methods=('get',),
+        url_path='similar',
+        url_name='similar',
+    )
+    def similar(self, request, pk):
+        """Похожие рецепты по ингредиентам и тегам"""
+
+        return self.cached_response(self.similar_recipes, request, pk=pk)
+
+    def similar_recipes(self, request, pk):
+        recipe = get_object_or_404(Recipe, id=pk)
+        queryset = self.get_queryset().filter(
+            similar_to__recipe=recipe
+        ).annotate(similarity=F('similar_to__score')).order_by(
+            '-similarity', 'id')
+        serializer = self.get_serializer(queryset, many=True)
+        return Response(serializer.data)
+
     @action(
         detail=True,
         methods=('post', 'delete'),
@@ -173,7 +353,8 @@ class RecipeViewSet(ModelViewSet):
                      f'Рецепт: {recipe.name} уже есть в списке покупок!'},
                     status=status.HTTP_400_BAD_REQUEST
                 )
-            ShoppingCart.objects.create(user=user, recipe=recipe)
+            with transaction.atomic():
+                ShoppingCart.objects.create(user=user, recipe=recipe)
             serializer = AddFavoritesSerializer(recipe)
             return Response(serializer.data, status=status.HTTP_201_CREATED)
 
@@ -188,3 +369,21 @@ class RecipeViewSet(ModelViewSet):
              f'{recipe.name} - его нет в списке покупок!'},
             status=status.HTTP_400_BAD_REQUEST
         )
+
+
+class CacheStatsView(APIView):
+    """Счётчики попаданий и промахов кэша ответов"""
+
+    permission_classes = (IsAdminUser,)
+
+    def get(self, request):
+        return Response(response_cache.stats())
+
+
+class DatabaseStatsView(APIView):
+    """Счётчики открытых и переиспользованных соединений с базой"""
+
+    permission_classes = (IsAdminUser,)
+
+    def get(self, request):
+        return Response(connection_stats())
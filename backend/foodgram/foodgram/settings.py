@@ -19,6 +19,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'rest_framework',
     'rest_framework.authtoken',
     'djoser',
@@ -30,6 +31,7 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'api.replicas.ReplicaMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -59,17 +61,54 @@ TEMPLATES = [
 WSGI_APPLICATION = 'foodgram.wsgi.application'
 
 
+# Потоки процесса: обработки запросов (должно совпадать с gunicorn
+# --threads) и фоновых задач (миниатюры, ленты и один поток похожих
+# рецептов). По ним считаются лимиты соединений с базой; ещё один слот
+# потоков запросов - для основного потока, который в runserver держит
+# соединение после проверки миграций.
+WEB_THREADS = int(os.getenv('WEB_THREADS', default=1))
+RECIPE_IMAGE_WORKERS = int(os.getenv('RECIPE_IMAGE_WORKERS', default=2))
+FEED_WORKERS = int(os.getenv('FEED_WORKERS', default=1))
+
 DATABASES = {
     'default': {
-        'ENGINE': os.getenv('DB_ENGINE', default='django.db.backends.postgresql'),
+        'ENGINE': os.getenv('DB_ENGINE', default='api.postgresql'),
         'NAME': os.getenv('POSTGRES_DB', default='postgres'),
         'USER': os.getenv('POSTGRES_USER', default='postgres'),
         'PASSWORD': os.getenv('POSTGRES_PASSWORD', default='postgres'),
         'HOST': os.getenv('DB_HOST', default='db_host'),
-        'PORT': os.getenv('DB_PORT', default='54322')
+        'PORT': os.getenv('DB_PORT', default='54322'),
+        'CONN_MAX_AGE': int(os.getenv('DB_CONN_MAX_AGE', default=60)),
+        'CONN_HEALTH_CHECKS': os.getenv(
+            'DB_CONN_HEALTH_CHECKS', default='True') == 'True',
+        'POOL_SIZE': int(os.getenv('DB_POOL_SIZE', default=WEB_THREADS + 1)),
+        'BACKGROUND_POOL_SIZE': int(os.getenv(
+            'DB_BACKGROUND_POOL_SIZE',
+            default=RECIPE_IMAGE_WORKERS + FEED_WORKERS + 1
+        )),
+        'POOL_TIMEOUT': float(os.getenv('DB_POOL_TIMEOUT', default=10)),
     }
 }
 
+if os.getenv('REPLICA_DB_HOST') or os.getenv('REPLICA_DB_NAME'):
+    DATABASES['replica'] = {
+        **DATABASES['default'],
+        'NAME': os.getenv(
+            'REPLICA_DB_NAME', default=DATABASES['default']['NAME']),
+        'HOST': os.getenv(
+            'REPLICA_DB_HOST', default=DATABASES['default']['HOST']),
+        'PORT': os.getenv(
+            'REPLICA_DB_PORT', default=DATABASES['default']['PORT']),
+        'TEST': {'MIRROR': 'default'},
+    }
+
+DATABASE_ROUTERS = ['api.replicas.ReplicaRouter']
+REPLICA_MAX_LAG = float(os.getenv('REPLICA_MAX_LAG', default=5))
+REPLICA_CHECK_INTERVAL = float(os.getenv('REPLICA_CHECK_INTERVAL', default=5))
+REPLICA_PIN_SECONDS = int(os.getenv('REPLICA_PIN_SECONDS', default=10))
+REPLICA_PIN_COOKIE = 'read_primary'
+REPLICA_PIN_HEADER = 'X-Read-Primary'
+
 
 AUTH_PASSWORD_VALIDATORS = [
     {
@@ -102,6 +141,39 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'static')
 
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
+DEFAULT_FILE_STORAGE = 'api.storage.ContentAddressedStorage'
+
+FILE_UPLOAD_HANDLERS = ['api.uploads.LimitedUploadHandler']
+UPLOAD_MAX_SIZE = int(os.getenv('UPLOAD_MAX_SIZE', default=10 * 1024 * 1024))
+UPLOAD_MAX_PIXELS = int(os.getenv('UPLOAD_MAX_PIXELS', default=40_000_000))
+
+RECIPE_IMAGE_WIDTHS = tuple(
+    int(width) for width
+    in os.getenv('RECIPE_IMAGE_WIDTHS', default='160,320,640').split(',')
+)
+RECIPE_IMAGE_CARD_WIDTH = int(os.getenv('RECIPE_IMAGE_CARD_WIDTH', default=320))
+RECIPE_IMAGE_QUALITY = int(os.getenv('RECIPE_IMAGE_QUALITY', default=80))
+
+FEED_BATCH_SIZE = int(os.getenv('FEED_BATCH_SIZE', default=1000))
+FEED_SYNC_FANOUT_LIMIT = int(os.getenv('FEED_SYNC_FANOUT_LIMIT', default=1000))
+FEED_BACKFILL_LIMIT = int(os.getenv('FEED_BACKFILL_LIMIT', default=50))
+
+SIMILAR_RECIPES_COUNT = int(os.getenv('SIMILAR_RECIPES_COUNT', default=10))
+SIMILAR_RECIPES_TAG_WEIGHT = float(
+    os.getenv('SIMILAR_RECIPES_TAG_WEIGHT', default=0.5)
+)
+SIMILAR_RECIPES_COMMON_SHARE = float(
+    os.getenv('SIMILAR_RECIPES_COMMON_SHARE', default=0.2)
+)
+# В каталоге меньше этого числа рецептов частые ингредиенты не отделяются.
+SIMILAR_RECIPES_MIN_CATALOGUE = int(
+    os.getenv('SIMILAR_RECIPES_MIN_CATALOGUE', default=1000)
+)
+SIMILAR_RECIPES_BLOCK = int(os.getenv('SIMILAR_RECIPES_BLOCK', default=256))
+
+PANTRY_INDEX_DELTA_LIMIT = int(
+    os.getenv('PANTRY_INDEX_DELTA_LIMIT', default=1000)
+)
 
 
 AUTH_USER_MODEL = 'users.User'
@@ -112,7 +184,7 @@ REST_FRAMEWORK = {
     ],
 
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        'api.authentication.CachedTokenAuthentication',
     ],
     'DEFAULT_FILTER_BACKENDS': ['django_filters.rest_framework.DjangoFilterBackend'],
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
@@ -140,3 +212,37 @@ DJOSER = {
 }
 
 CSV_FILES_DIR = os.path.join(BASE_DIR, 'data')
+
+SHOPPING_LIST_PDF_CONCURRENCY = int(
+    os.getenv('SHOPPING_LIST_PDF_CONCURRENCY', default=2))
+SHOPPING_LIST_PDF_FONT = os.getenv(
+    'SHOPPING_LIST_PDF_FONT',
+    default='/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf'
+)
+
+INGREDIENT_INDEX_PATH = os.getenv(
+    'INGREDIENT_INDEX_PATH',
+    default=os.path.join(BASE_DIR, 'data', 'ingredient_index.bin')
+)
+
+INGREDIENT_SEARCH_LIMIT = int(os.getenv('INGREDIENT_SEARCH_LIMIT', default=20))
+INGREDIENT_SEARCH_SIMILARITY = float(
+    os.getenv('INGREDIENT_SEARCH_SIMILARITY', default=0.15)
+)
+
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv(
+            'CACHE_BACKEND',
+            default='django.core.cache.backends.locmem.LocMemCache'
+        ),
+        'LOCATION': os.getenv('CACHE_LOCATION', default='foodgram'),
+    }
+}
+
+RESPONSE_CACHE_ALIAS = 'default'
+RESPONSE_CACHE_TIMEOUT = int(os.getenv('RESPONSE_CACHE_TIMEOUT', default=86400))
+AUTH_TOKEN_CACHE_ALIAS = 'default'
+AUTH_TOKEN_CACHE_TIMEOUT = int(
+    os.getenv('AUTH_TOKEN_CACHE_TIMEOUT', default=60)
+)
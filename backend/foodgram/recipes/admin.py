@@ -1,25 +1,64 @@
+from django import forms
 from django.contrib import admin
+from django.contrib.admin.widgets import AutocompleteSelect
 
-from .models import Ingredient, Recipe
+from .models import Ingredient, IngredientInRecipe, Recipe
+
+
+class SelectedAutocompleteSelect(AutocompleteSelect):
+    """Автокомплит, подпись выбранного значения которого берётся из уже
+    загруженного объекта, а не отдельным запросом на каждую строку."""
+
+    selected = None
+
+    def optgroups(self, name, value, attr=None):
+        if self.selected is None or [str(item) for item in value] != [
+                str(self.selected.pk)]:
+            return super().optgroups(name, value, attr)
+        return [(None, [self.create_option(
+            name, self.selected.pk, str(self.selected), True, 0)], 0)]
+
+
+class IngredientInRecipeForm(forms.ModelForm):
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        widget = self.fields['ingredient'].widget
+        widget = getattr(widget, 'widget', widget)
+        if self.instance.ingredient_id is not None:
+            widget.selected = self.instance.ingredient
 
 
 class IngredientsInline(admin.TabularInline):
-    model = Recipe.ingredients.through
+    model = IngredientInRecipe
+    form = IngredientInRecipeForm
+    extra = 1
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related(
+            'ingredient', 'recipe')
+
+    def formfield_for_foreignkey(self, db_field, request, **kwargs):
+        if db_field.name == 'ingredient':
+            kwargs['widget'] = SelectedAutocompleteSelect(
+                db_field, self.admin_site, using=kwargs.get('using'))
+        return super().formfield_for_foreignkey(db_field, request, **kwargs)
 
 
 @admin.register(Recipe)
 class RecipeAdmin(admin.ModelAdmin):
-    list_display = ('pk', 'name', 'author', 'count_favorites',)
+    list_display = ('pk', 'name', 'author', 'favorites_count',)
+    list_select_related = ('author',)
     inlines = (IngredientsInline, )
-    list_filter = ('author', 'name', 'tags',)
-    search_fields = ('name',)
-
-    def count_favorites(self, obj):
-        return obj.favorites.count()
-    count_favorites.short_description = 'Добавлений в избранное'
+    list_filter = ('tags',)
+    search_fields = ('name', 'author__username', 'author__email',)
+    autocomplete_fields = ('author',)
+    show_full_result_count = False
 
 
 @admin.register(Ingredient)
 class IngredientAdmin(admin.ModelAdmin):
     list_display = ('name', 'measurement_unit',)
-    list_filter = ('name',)
+    list_filter = ('measurement_unit',)
+    search_fields = ('name',)
+    show_full_result_count = False
@@ -0,0 +1,62 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Sum
+from recipes.models import IngredientInRecipe, ShoppingListItem
+
+
+class Command(BaseCommand):
+    help = ('Пересобирает сводные списки покупок из корзин '
+            'или проверяет их расхождение (--check).')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check',
+            action='store_true',
+            help='Только сравнить списки с корзинами, ничего не изменяя.'
+        )
+
+    @staticmethod
+    def source_totals():
+        return IngredientInRecipe.objects.filter(
+            recipe__shopping_recipe__isnull=False).values_list(
+            'recipe__shopping_recipe__user', 'ingredient').annotate(
+            total=Sum('amount')).order_by()
+
+    def handle(self, *args, **options):
+        expected = {
+            (user_id, ingredient_id): total
+            for user_id, ingredient_id, total
+            in self.source_totals().iterator()
+        }
+        if options['check']:
+            stored = {
+                (user_id, ingredient_id): total
+                for user_id, ingredient_id, total
+                in ShoppingListItem.objects.values_list(
+                    'user_id', 'ingredient_id', 'total_amount').iterator()
+            }
+            drift = {
+                key for key in expected.keys() | stored.keys()
+                if expected.get(key) != stored.get(key)
+            }
+            for user_id, ingredient_id in sorted(drift):
+                self.stdout.write(
+                    f'user={user_id} ingredient={ingredient_id}: '
+                    f'ожидается {expected.get((user_id, ingredient_id))}, '
+                    f'в списке {stored.get((user_id, ingredient_id))}'
+                )
+            if drift:
+                raise CommandError(f'Расхождений: {len(drift)}')
+            self.stdout.write(self.style.SUCCESS(
+                f'Списки покупок согласованы ({len(stored)} позиций)'))
+            return
+        with transaction.atomic():
+            ShoppingListItem.objects.all().delete()
+            ShoppingListItem.objects.bulk_create(
+                (ShoppingListItem(user_id=user_id, ingredient_id=ingredient_id,
+                                  total_amount=total)
+                 for (user_id, ingredient_id), total in expected.items()),
+                batch_size=1000
+            )
+        self.stdout.write(self.style.SUCCESS(
+            f'Списки покупок пересобраны ({len(expected)} позиций)'))
@@ -0,0 +1,58 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from recipes.models import Favorite, Recipe
+from users.models import Follow, User
+
+
+def actual_count(model, field):
+    return Coalesce(Subquery(
+        model.objects.filter(**{field: OuterRef('pk')}).order_by()
+        .values(field).annotate(total=Count('pk')).values('total')
+    ), 0)
+
+
+COUNTERS = (
+    (Recipe, 'favorites_count', Favorite, 'recipe'),
+    (User, 'recipes_count', Recipe, 'author'),
+    (User, 'followers_count', Follow, 'author'),
+)
+
+
+class Command(BaseCommand):
+    help = ('Пересчитывает счётчики избранного, рецептов и подписчиков '
+            'или проверяет их расхождение (--check).')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check',
+            action='store_true',
+            help='Только сравнить счётчики с данными, ничего не изменяя.'
+        )
+
+    def handle(self, *args, **options):
+        total = 0
+        with transaction.atomic():
+            for model, field, source, key in COUNTERS:
+                drift = model.objects.annotate(
+                    actual=actual_count(source, key)).exclude(
+                    **{field: F('actual')})
+                for pk, stored, actual in drift.values_list(
+                        'pk', field, 'actual'):
+                    self.stdout.write(
+                        f'{model._meta.model_name}={pk} {field}: '
+                        f'хранится {stored}, должно быть {actual}')
+                if not options['check']:
+                    total += model.objects.filter(
+                        pk__in=drift.values('pk')).update(
+                        **{field: actual_count(source, key)})
+                else:
+                    total += drift.count()
+        if options['check']:
+            if total:
+                raise CommandError(f'Расхождений: {total}')
+            self.stdout.write(self.style.SUCCESS('Счётчики согласованы'))
+            return
+        self.stdout.write(self.style.SUCCESS(
+            f'Исправлено счётчиков: {total}'))
@@ -0,0 +1,123 @@
+# Generated by Django 3.2.16 on 2026-10-18 04:23
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.db import migrations
+
+SEARCH_VECTOR_SQL = """
+CREATE FUNCTION recipe_search_vector(bigint, text, text) RETURNS tsvector
+LANGUAGE sql STABLE AS $$
+    SELECT setweight(to_tsvector('russian', coalesce($2, '')), 'A')
+        || setweight(to_tsvector('russian', coalesce($3, '')), 'B')
+        || setweight(to_tsvector('russian', coalesce((
+            SELECT string_agg(ingredient.name, ' ')
+            FROM recipes_ingredientinrecipe AS item
+            JOIN recipes_ingredient AS ingredient
+                ON ingredient.id = item.ingredient_id
+            WHERE item.recipe_id = $1), '')), 'C')
+$$;
+
+CREATE FUNCTION recipe_search_vector_trigger() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+    NEW.search_vector := recipe_search_vector(NEW.id, NEW.name, NEW.text);
+    RETURN NEW;
+END
+$$;
+
+CREATE TRIGGER recipe_search_vector
+BEFORE INSERT OR UPDATE OF name, text ON recipes_recipe
+FOR EACH ROW EXECUTE FUNCTION recipe_search_vector_trigger();
+
+CREATE FUNCTION ingredient_in_recipe_search_vector_trigger() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        UPDATE recipes_recipe AS recipe
+        SET search_vector = recipe_search_vector(
+            recipe.id, recipe.name, recipe.text)
+        WHERE recipe.id IN (SELECT recipe_id FROM old_rows);
+    ELSE
+        UPDATE recipes_recipe AS recipe
+        SET search_vector = recipe_search_vector(
+            recipe.id, recipe.name, recipe.text)
+        WHERE recipe.id IN (SELECT recipe_id FROM new_rows);
+    END IF;
+    RETURN NULL;
+END
+$$;
+
+CREATE TRIGGER ingredient_in_recipe_search_vector_insert
+AFTER INSERT ON recipes_ingredientinrecipe
+REFERENCING NEW TABLE AS new_rows
+FOR EACH STATEMENT
+EXECUTE FUNCTION ingredient_in_recipe_search_vector_trigger();
+
+CREATE TRIGGER ingredient_in_recipe_search_vector_update
+AFTER UPDATE ON recipes_ingredientinrecipe
+REFERENCING NEW TABLE AS new_rows
+FOR EACH STATEMENT
+EXECUTE FUNCTION ingredient_in_recipe_search_vector_trigger();
+
+CREATE TRIGGER ingredient_in_recipe_search_vector_delete
+AFTER DELETE ON recipes_ingredientinrecipe
+REFERENCING OLD TABLE AS old_rows
+FOR EACH STATEMENT
+EXECUTE FUNCTION ingredient_in_recipe_search_vector_trigger();
+
+CREATE FUNCTION ingredient_search_vector_trigger() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+    UPDATE recipes_recipe AS recipe
+    SET search_vector = recipe_search_vector(
+        recipe.id, recipe.name, recipe.text)
+    WHERE recipe.id IN (
+        SELECT recipe_id FROM recipes_ingredientinrecipe
+        WHERE ingredient_id = NEW.id);
+    RETURN NULL;
+END
+$$;
+
+CREATE TRIGGER ingredient_search_vector
+AFTER UPDATE OF name ON recipes_ingredient
+FOR EACH ROW WHEN (OLD.name IS DISTINCT FROM NEW.name)
+EXECUTE FUNCTION ingredient_search_vector_trigger();
+
+UPDATE recipes_recipe
+SET search_vector = recipe_search_vector(id, name, text);
+"""
+
+DROP_SEARCH_VECTOR_SQL = """
+DROP TRIGGER ingredient_search_vector ON recipes_ingredient;
+DROP FUNCTION ingredient_search_vector_trigger();
+DROP TRIGGER ingredient_in_recipe_search_vector_delete
+    ON recipes_ingredientinrecipe;
+DROP TRIGGER ingredient_in_recipe_search_vector_update
+    ON recipes_ingredientinrecipe;
+DROP TRIGGER ingredient_in_recipe_search_vector_insert
+    ON recipes_ingredientinrecipe;
+DROP FUNCTION ingredient_in_recipe_search_vector_trigger();
+DROP TRIGGER recipe_search_vector ON recipes_recipe;
+DROP FUNCTION recipe_search_vector_trigger();
+DROP FUNCTION recipe_search_vector(bigint, text, text);
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0012_ingredient_ingredient_name_trgm'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, help_text='Заполняется триггерами базы из названия, описания и ингредиентов рецепта', null=True, verbose_name='Поисковый вектор'),
+        ),
+        migrations.AddIndex(
+            model_name='recipe',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='recipe_search_vector'),
+        ),
+        migrations.RunSQL(SEARCH_VECTOR_SQL, DROP_SEARCH_VECTOR_SQL),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 3.2.16 on 2026-10-18 04:36
+
+from django.db import migrations, models
+
+
+def merge_duplicate_ingredients(apps, schema_editor):
+    Ingredient = apps.get_model('recipes', 'Ingredient')
+    IngredientInRecipe = apps.get_model('recipes', 'IngredientInRecipe')
+    ShoppingListItem = apps.get_model('recipes', 'ShoppingListItem')
+    duplicates = Ingredient.objects.values(
+        'name', 'measurement_unit').annotate(
+        keep=models.Min('id'), total=models.Count('id')).filter(
+        total__gt=1).order_by()
+    for group in duplicates.iterator():
+        keep = group['keep']
+        others = list(Ingredient.objects.filter(
+            name=group['name'],
+            measurement_unit=group['measurement_unit']
+        ).exclude(id=keep).values_list('id', flat=True))
+        for model, owner, amount in (
+                (IngredientInRecipe, 'recipe_id', 'amount'),
+                (ShoppingListItem, 'user_id', 'total_amount')):
+            for row in model.objects.filter(ingredient_id__in=others):
+                merged = model.objects.filter(
+                    ingredient_id=keep,
+                    **{owner: getattr(row, owner)}).update(
+                    **{amount: models.F(amount) + getattr(row, amount)})
+                if merged:
+                    row.delete()
+                else:
+                    row.ingredient_id = keep
+                    row.save(update_fields=('ingredient',))
+        Ingredient.objects.filter(id__in=others).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0015_auto_20261018_0427'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            merge_duplicate_ingredients, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.2.16 on 2026-10-18 04:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0017_ingredient_unique'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='image_variants',
+            field=models.JSONField(default=list, editable=False, help_text='Заполняется фоновой обработкой после загрузки; пока список пуст, отдаётся оригинал.', verbose_name='Ширины уменьшенных копий фотографии'),
+        ),
+    ]
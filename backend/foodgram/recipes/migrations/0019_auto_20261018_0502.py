@@ -0,0 +1,40 @@
+# Generated by Django 3.2.16 on 2026-10-18 05:02
+
+from django.db import migrations, models
+
+
+def count_image_references(apps, schema_editor):
+    Recipe = apps.get_model('recipes', 'Recipe')
+    StoredFile = apps.get_model('recipes', 'StoredFile')
+    StoredFile.objects.bulk_create(
+        (StoredFile(name=name, references=total)
+         for name, total in Recipe.objects.exclude(image='').values_list(
+             'image').annotate(total=models.Count('id')).order_by()
+         .iterator()),
+        batch_size=1000
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0018_recipe_image_variants'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StoredFile',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True, verbose_name='Имя файла')),
+                ('references', models.PositiveIntegerField(default=0, verbose_name='Число ссылок')),
+                ('updated', models.DateTimeField(auto_now=True, verbose_name='Дата изменения')),
+            ],
+            options={
+                'verbose_name': 'Файл',
+                'verbose_name_plural': 'Файлы',
+            },
+        ),
+        migrations.RunPython(
+            count_image_references, migrations.RunPython.noop),
+    ]
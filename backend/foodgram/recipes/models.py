@@ -1,7 +1,11 @@
+from django.conf import settings
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
 from django.core.validators import (MaxValueValidator, MinValueValidator,
                                     RegexValidator)
-from django.db import models
-from users.models import User
+from django.db import IntegrityError, connections, models, transaction
+from django.utils import timezone
+from users.models import CounterFieldsMixin, Follow, User
 
 
 class Tag(models.Model):
@@ -59,12 +63,25 @@ class Ingredient(models.Model):
         ordering = ('name',)
         verbose_name = 'Ингредиент'
         verbose_name_plural = 'Ингредиенты'
+        constraints = (
+            models.UniqueConstraint(
+                fields=('name', 'measurement_unit'),
+                name='Уникальный ингредиент'
+            ),
+        )
+        indexes = (
+            GinIndex(
+                fields=('name',),
+                name='ingredient_name_trgm',
+                opclasses=('gin_trgm_ops',)
+            ),
+        )
 
     def __str__(self):
         return f'{self.name}, {self.measurement_unit}'
 
 
-class Recipe(models.Model):
+class Recipe(CounterFieldsMixin, models.Model):
     """Модель рецепта"""
 
     author = models.ForeignKey(
@@ -88,6 +105,19 @@ class Recipe(models.Model):
         upload_to='recipes/',
         blank=False
     )
+    favorites_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        db_index=True,
+        verbose_name='Добавлений в избранное'
+    )
+    image_variants = models.JSONField(
+        default=list,
+        editable=False,
+        verbose_name='Ширины уменьшенных копий фотографии',
+        help_text='Заполняется фоновой обработкой после загрузки; '
+                  'пока список пуст, отдаётся оригинал.'
+    )
     text = models.TextField(
         verbose_name='Описание рецепта',
         blank=False
@@ -118,11 +148,30 @@ class Recipe(models.Model):
         db_index=True,
         verbose_name='Дата публикации рецепта'
     )
+    updated = models.DateTimeField(
+        auto_now=True,
+        db_index=True,
+        verbose_name='Дата изменения рецепта'
+    )
+    search_vector = SearchVectorField(
+        null=True,
+        editable=False,
+        verbose_name='Поисковый вектор',
+        help_text='Заполняется триггерами базы из названия, описания '
+                  'и ингредиентов рецепта'
+    )
+
+    counter_fields = ('favorites_count',)
 
     class Meta:
         verbose_name = 'Рецепт'
         verbose_name_plural = 'Рецепты'
         ordering = ('-created',)
+        indexes = (
+            GinIndex(fields=('search_vector',), name='recipe_search_vector'),
+            models.Index(
+                fields=('-created', '-id'), name='recipe_created_id'),
+        )
 
     def __str__(self):
         return self.name
@@ -248,3 +297,336 @@ class Favorite(models.Model):
 
     def __str__(self):
         return f'{self.user} {self.recipe}'
+
+
+UPSERT_BATCH_SIZE = 1000
+
+
+class ShoppingListItemManager(models.Manager):
+    """Инкрементальное обновление сводных списков покупок."""
+
+    def add_amounts(self, user_ids, amounts):
+        """Прибавляет количества {ingredient_id: amount} к спискам
+        покупок пользователей, отрицательные значения вычитаются."""
+
+        amounts = {pk: amount for pk, amount in amounts.items() if amount}
+        user_ids = list(user_ids)
+        if not user_ids or not amounts:
+            return
+        rows = sorted(
+            (user_id, pk, amount)
+            for user_id in user_ids for pk, amount in amounts.items()
+        )
+        connection = connections[self.db]
+        table = connection.ops.quote_name(self.model._meta.db_table)
+        with transaction.atomic(using=self.db):
+            # INSERT ... ON CONFLICT DO UPDATE прибавляет к строке под её
+            # блокировкой или создаёт её, даже если другая транзакция
+            # только что удалила строку. Строки упорядочены, чтобы
+            # одновременные вставки не блокировали друг друга крест-накрест.
+            with connection.cursor() as cursor:
+                for start in range(0, len(rows), UPSERT_BATCH_SIZE):
+                    batch = rows[start:start + UPSERT_BATCH_SIZE]
+                    cursor.execute(
+                        f'INSERT INTO {table} '
+                        '(user_id, ingredient_id, total_amount) VALUES '
+                        + ', '.join(['(%s, %s, %s)'] * len(batch))
+                        + ' ON CONFLICT (user_id, ingredient_id) DO UPDATE '
+                        f'SET total_amount = {table}.total_amount '
+                        '+ EXCLUDED.total_amount',
+                        [value for row in batch for value in row]
+                    )
+            self.filter(
+                user_id__in=user_ids, total_amount__lte=0).delete()
+
+    def add_recipe(self, user_ids, recipe_id, sign=1):
+        """Добавляет (sign=1) или вычитает (sign=-1) ингредиенты рецепта."""
+
+        amounts = IngredientInRecipe.objects.filter(
+            recipe_id=recipe_id).values_list('ingredient_id', 'amount')
+        self.add_amounts(
+            user_ids, {pk: sign * amount for pk, amount in amounts})
+
+
+class ShoppingListItem(models.Model):
+    """Сводный список покупок пользователя по ингредиентам."""
+
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='shopping_list',
+        verbose_name='Пользователь'
+    )
+    ingredient = models.ForeignKey(
+        Ingredient,
+        on_delete=models.CASCADE,
+        related_name='in_shopping_list',
+        verbose_name='Ингредиент'
+    )
+    total_amount = models.IntegerField(verbose_name='Общее количество')
+
+    objects = ShoppingListItemManager()
+
+    class Meta:
+        verbose_name = 'Позиция списка покупок'
+        verbose_name_plural = 'Позиции списков покупок'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'ingredient'],
+                name='Уникальная позиция списка покупок'
+            )
+        ]
+
+    def __str__(self):
+        return f'{self.user} {self.ingredient} {self.total_amount}'
+
+
+class ModelVersionManager(models.Manager):
+
+    @staticmethod
+    def key_for(model, user_id=None):
+        key = model._meta.label_lower
+        if user_id is not None:
+            key = f'{key}:{user_id}'
+        return key
+
+    def bump(self, key):
+        """Увеличивает счётчик версии, создавая его при первом изменении."""
+
+        if self.filter(key=key).update(
+                version=models.F('version') + 1, updated=timezone.now()):
+            return
+        try:
+            with transaction.atomic():
+                self.create(key=key, version=1)
+        except IntegrityError:
+            self.bump(key)
+
+    def get_versions(self, keys):
+        """Словарь {key: (version, updated)} для существующих счётчиков."""
+
+        return {
+            key: (version, updated) for key, version, updated
+            in self.filter(key__in=keys).values_list(
+                'key', 'version', 'updated')
+        }
+
+
+class ModelVersion(models.Model):
+    """Счётчик версии таблицы или данных пользователя для валидаторов
+    условных запросов и ключей кэша."""
+
+    key = models.CharField(
+        max_length=100,
+        unique=True,
+        verbose_name='Ключ'
+    )
+    version = models.PositiveBigIntegerField(
+        default=0,
+        verbose_name='Версия'
+    )
+    updated = models.DateTimeField(
+        auto_now=True,
+        verbose_name='Дата изменения'
+    )
+
+    objects = ModelVersionManager()
+
+    class Meta:
+        verbose_name = 'Версия данных'
+        verbose_name_plural = 'Версии данных'
+
+    def __str__(self):
+        return f'{self.key} {self.version}'
+
+
+class StoredFileManager(models.Manager):
+
+    def change_references(self, name, delta):
+        """Меняет счётчик ссылок на файл, создавая запись при первой ссылке."""
+
+        if not name:
+            return
+        files = self.filter(name=name)
+        if delta < 0:
+            files = files.filter(references__gte=-delta)
+        if files.update(references=models.F('references') + delta,
+                        updated=timezone.now()) or delta < 0:
+            return
+        try:
+            with transaction.atomic():
+                self.create(name=name, references=delta)
+        except IntegrityError:
+            self.change_references(name, delta)
+
+
+class StoredFile(models.Model):
+    """Файл в хранилище с адресацией по содержимому и число ссылок на него.
+
+    Один файл может принадлежать нескольким рецептам; файлы без ссылок
+    удаляет команда collect_media.
+    """
+
+    name = models.CharField(
+        max_length=100,
+        unique=True,
+        verbose_name='Имя файла'
+    )
+    references = models.PositiveIntegerField(
+        default=0,
+        verbose_name='Число ссылок'
+    )
+    updated = models.DateTimeField(
+        auto_now=True,
+        verbose_name='Дата изменения'
+    )
+
+    objects = StoredFileManager()
+
+    class Meta:
+        verbose_name = 'Файл'
+        verbose_name_plural = 'Файлы'
+
+    def __str__(self):
+        return f'{self.name} ({self.references})'
+
+
+class FeedEntryManager(models.Manager):
+    """Наполнение лент подписчиков при записи (fan-out on write)."""
+
+    def fan_out(self, recipe, after=0, limit=None):
+        """Добавляет рецепт в ленты подписчиков автора пачками
+        по FEED_BATCH_SIZE, начиная с подписки после id after.
+
+        Обрабатывает не больше limit подписчиков и возвращает id
+        последней обработанной подписки или None, если подписчики
+        закончились.
+        """
+        processed = 0
+        while limit is None or processed < limit:
+            size = settings.FEED_BATCH_SIZE
+            if limit is not None:
+                size = min(size, limit - processed)
+            batch = list(Follow.objects.filter(
+                author_id=recipe.author_id, id__gt=after
+            ).order_by('id').values_list('id', 'user_id')[:size])
+            if not batch:
+                return None
+            self.bulk_create(
+                (self.model(user_id=user_id, recipe_id=recipe.pk,
+                            author_id=recipe.author_id,
+                            created=recipe.created)
+                 for _, user_id in batch),
+                ignore_conflicts=True
+            )
+            after = batch[-1][0]
+            processed += len(batch)
+        return after
+
+    def backfill(self, user_id, author_id):
+        """Последние FEED_BACKFILL_LIMIT рецептов автора в ленту
+        нового подписчика."""
+
+        recipes = Recipe.objects.filter(author_id=author_id).order_by(
+            '-created', '-id').values_list('id', 'created')
+        self.bulk_create(
+            (self.model(user_id=user_id, recipe_id=pk, author_id=author_id,
+                        created=created)
+             for pk, created in recipes[:settings.FEED_BACKFILL_LIMIT]),
+            ignore_conflicts=True
+        )
+
+    def prune(self, user_id, author_id):
+        self.filter(user_id=user_id, author_id=author_id).delete()
+
+
+class FeedEntry(models.Model):
+    """Рецепт в ленте подписчика его автора.
+
+    Дата публикации и автор копируются из рецепта, чтобы лента читалась
+    по индексу (user, -created) без соединения с подписками.
+    """
+
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='feed',
+        db_index=False,
+        verbose_name='Подписчик'
+    )
+    recipe = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        related_name='feed_entries',
+        verbose_name='Рецепт'
+    )
+    author = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='+',
+        db_index=False,
+        verbose_name='Автор рецепта'
+    )
+    created = models.DateTimeField(
+        verbose_name='Дата публикации рецепта'
+    )
+
+    objects = FeedEntryManager()
+
+    class Meta:
+        verbose_name = 'Запись ленты'
+        verbose_name_plural = 'Записи ленты'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'recipe'], name='Уникальная запись ленты'
+            )
+        ]
+        indexes = [
+            models.Index(
+                fields=['user', '-created', '-recipe'],
+                name='feed_user_created'
+            ),
+            models.Index(
+                fields=['author', 'user'], name='feed_author_user'
+            ),
+        ]
+
+    def __str__(self):
+        return f'{self.user} {self.recipe}'
+
+
+class SimilarRecipe(models.Model):
+    """Похожий рецепт из top-k соседей по ингредиентам и тегам.
+
+    Заполняется командой build_similar_recipes и обновляется при
+    изменении ингредиентов или тегов рецепта.
+    """
+
+    recipe = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        related_name='similar',
+        db_index=False,
+        verbose_name='Рецепт'
+    )
+    similar = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        related_name='similar_to',
+        verbose_name='Похожий рецепт'
+    )
+    score = models.FloatField(
+        verbose_name='Сходство'
+    )
+
+    class Meta:
+        verbose_name = 'Похожий рецепт'
+        verbose_name_plural = 'Похожие рецепты'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['recipe', 'similar'], name='Уникальный похожий рецепт'
+            )
+        ]
+
+    def __str__(self):
+        return f'{self.recipe} ~ {self.similar} ({self.score:.3f})'
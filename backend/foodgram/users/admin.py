@@ -6,12 +6,17 @@ from .models import Follow, User
 @admin.register(User)
 class UserAdmin(admin.ModelAdmin):
     list_display = ('pk', 'username', 'email', 'first_name', 'last_name',
-                    'password',)
-    list_filter = ('username', 'email',)
+                    'recipes_count', 'followers_count', 'password',)
+    list_filter = ('is_staff', 'is_active',)
     search_fields = ('username', 'email',)
+    show_full_result_count = False
 
 
 @admin.register(Follow)
 class FollowAdmin(admin.ModelAdmin):
     list_display = ('author', 'user',)
-    search_fields = ('author', 'user',)
+    list_select_related = ('author', 'user',)
+    search_fields = ('author__username', 'author__email',
+                     'user__username', 'user__email',)
+    autocomplete_fields = ('author', 'user',)
+    show_full_result_count = False